@@ -4,6 +4,10 @@ This module allows to load an airport description file
 and to access to all its elements information."""
 
 import enum
+
+import numpy as np
+
+import datacache
 import geometry
 
 
@@ -33,8 +37,7 @@ class NamedPoint(geometry.Point):
     - type: STAND | DEICING | RUNWAY_POINT (type of point)
     - x and y: coordinates of the point (inherited from Point)"""
 
-    def __init__(self, name, pt_type, point):
-        x, y = map(int, point.split(','))
+    def __init__(self, name, pt_type, x, y):
         super().__init__(x, y)
         self.name = name
         self.type = pt_type
@@ -51,8 +54,8 @@ class Taxiway(geometry.PolyLine):
     - one_way: bool (is it a one-way portion ?)
     - coords: Point tuple (points composing the taxiway, inherited from PolyLine)"""
 
-    def __init__(self, taxi_name, speed, cat, one_way, coords):
-        super().__init__(coords)
+    def __init__(self, taxi_name, speed, cat, one_way, coords, length=None):
+        super().__init__(coords, length)
         self.taxi_name = taxi_name
         self.speed = speed
         self.cat = cat
@@ -70,8 +73,8 @@ class Runway(geometry.PolyLine):
     - ends: (Point, Point) (coordinates of end points of the runway, inherited from PolyLine)
     - named_points: NamedPoint tuple (named points on the runway axis)"""
 
-    def __init__(self, name, qfu1, qfu2, ends, named_points):
-        super().__init__(ends)
+    def __init__(self, name, qfu1, qfu2, ends, named_points, length=None):
+        super().__init__(ends, length)
         self.name = name
         self.qfus = (qfu1, qfu2)
         self.named_points = named_points
@@ -107,6 +110,12 @@ class Airport:
     def get_qfu(self, name):
         return name if name in self.qfu_dict else None
 
+    def digest(self):
+        """digest() return str
+        return the hash of the names of the points and QFUs of the airport,
+        which are what the flights parsed with it depend on (see traffic.parse_lines)"""
+        return datacache.digest([], ' '.join([self.name] + sorted(self.pt_dict) + sorted(self.qfu_dict)))
+
 
 # Reading an airport file
 
@@ -122,37 +131,115 @@ def xys_to_points(str_xy_list):
     return tuple(xy_to_point(str_xy) for str_xy in str_xy_list)
 
 
+def xys_to_array(str_xy_list):
+    """ xys_to_array(str list) returns int32 array: converts x,y str list to a (n, 2) array"""
+    words = ' '.join(str_xy_list).replace(',', ' ').split()
+    return np.array(words, dtype=np.int32).reshape(-1, 2)
+
+
+def points_to_array(points):
+    """ points_to_array(Point tuple) returns int32 array: converts Point tuple to a (n, 2) array"""
+    return np.array([(p.x, p.y) for p in points], dtype=np.int32).reshape(-1, 2)
+
+
 def from_file(filename):
-    """from_file(str) return Airport: reads an airport description file"""
+    """from_file(str) return Airport: reads an airport description file
+    (or its binary cache if it is up to date)"""
     print("Loading airport", filename + '...')
+    columns = datacache.load(filename)
+    if columns is None:
+        columns = parse(filename)
+        datacache.save(filename, columns)
+    for error in columns['errors']:
+        print(error)
+    apt = from_columns(columns)
+    print(apt.name + ':', len(apt.runways), "runways,",
+          len([p for p in apt.points if p.type == PointType.STAND]), "parking stands")
+    return apt
+
+
+def parse(filename):
+    """parse(str) return (str -> array) dict
+    reads an airport description file into columns of arrays"""
     file = open(filename)
     categories = {'L': WakeVortexCategory.LIGHT,
                   'M': WakeVortexCategory.MEDIUM,
                   'H': WakeVortexCategory.HEAVY}
     point_types = [PointType.STAND, PointType.DEICING, PointType.RUNWAY_POINT]
     name = file.readline().strip()
-    points, taxiways, runways = [], [], []
+    points, taxiways, runways, errors = [], [], [], []
     for line in file:
         words = line.strip().split()
         try:
             if words[0] == 'P':  # Point description
                 pt_type = point_types[int(words[2])]
-                points.append(NamedPoint(words[1], pt_type, words[3]))
+                x, y = map(int, words[3].split(','))
+                points.append((words[1], pt_type.value, x, y))
             elif words[0] == 'L':  # Taxiway description
                 speed = int(words[2])
                 cat = categories[words[3]]
                 one_way = words[4] == 'S'
                 xys = xys_to_points(words[5:])
-                taxiways.append(Taxiway(words[1], speed, cat, one_way, xys))
+                length = geometry.PolyLine(xys).length
+                taxiways.append((words[1], speed, cat.value, one_way, length, points_to_array(xys)))
             elif words[0] == 'R':  # Runway description
-                pts = tuple(words[4].split(','))
                 xys = xys_to_points(words[5:])
-                runways.append(Runway(words[1], words[2], words[3], xys, pts))
+                length = geometry.PolyLine(xys).length
+                runways.append((words[1], words[2], words[3], words[4], length, points_to_array(xys)))
         except Exception as error:
-            print(error, line)
+            errors.append(' '.join(map(str, (error, line))))
     file.close()
-    print(name + ':', len(runways), "runways,", len([p for p in points if p.type == PointType.STAND]), "parking stands")
-    return Airport(name, tuple(points), tuple(taxiways), tuple(runways))
+
+    def column(rows, i, dtype=None):
+        return np.array([row[i] for row in rows], dtype=dtype)
+
+    def coords(rows, i):
+        return (np.concatenate([row[i] for row in rows]) if rows else np.zeros((0, 2), dtype=np.int32),
+                np.array([len(row[i]) for row in rows], dtype=np.int64))
+
+    taxi_xy, taxi_lengths = coords(taxiways, 5)
+    runway_xy, runway_lengths = coords(runways, 5)
+    return {'name': np.array(name), 'errors': np.array(errors, dtype=str),
+            'point_name': column(points, 0, str), 'point_type': column(points, 1, np.int8),
+            'point_xy': np.array([row[2:] for row in points], dtype=np.int32).reshape(-1, 2),
+            'taxi_name': column(taxiways, 0, str), 'taxi_speed': column(taxiways, 1, np.int32),
+            'taxi_cat': column(taxiways, 2, np.int8), 'taxi_one_way': column(taxiways, 3, bool),
+            'taxi_length': column(taxiways, 4, float),
+            'taxi_xy': taxi_xy, 'taxi_lengths': taxi_lengths,
+            'runway_name': column(runways, 0, str), 'runway_qfu1': column(runways, 1, str),
+            'runway_qfu2': column(runways, 2, str), 'runway_points': column(runways, 3, str),
+            'runway_length': column(runways, 4, float),
+            'runway_xy': runway_xy, 'runway_lengths': runway_lengths}
+
+
+def from_columns(columns):
+    """from_columns((str -> array) dict) return Airport
+    builds the airport described by the columns read by 'parse' (the points of
+    all the polylines are created at once, then sliced into each polyline)"""
+
+    def polylines(prefix):
+        xs, ys = columns[prefix + '_xy'].T.tolist()
+        coords = list(map(geometry.Point, xs, ys))
+        ends = np.cumsum(columns[prefix + '_lengths']).tolist()
+        return [tuple(coords[start:end]) for (start, end) in zip([0] + ends[:-1], ends)]
+
+    categories = list(WakeVortexCategory)
+    point_types = list(PointType)
+    xs, ys = columns['point_xy'].T.tolist()
+    points = tuple(map(NamedPoint, columns['point_name'].tolist(),
+                       [point_types[pt_type - 1] for pt_type in columns['point_type'].tolist()], xs, ys))
+    taxiways = tuple(map(Taxiway, columns['taxi_name'].tolist(), columns['taxi_speed'].tolist(),
+                         [categories[cat - 1] for cat in columns['taxi_cat'].tolist()],
+                         columns['taxi_one_way'].tolist(), polylines('taxi'),
+                         columns['taxi_length'].tolist()))
+    runways = tuple(Runway(name, qfu1, qfu2, xys, tuple(pts.split(',')), length)
+                    for (name, qfu1, qfu2, pts, length, xys) in zip(columns['runway_name'].tolist(),
+                                                                    columns['runway_qfu1'].tolist(),
+                                                                    columns['runway_qfu2'].tolist(),
+                                                                    columns['runway_points'].tolist(),
+                                                                    columns['runway_length'].tolist(),
+                                                                    polylines('runway')))
+    return Airport(str(columns['name']), points, taxiways, runways)
 
 # Versions originales à faire modifier en TP
 # def find_point(apt, name):
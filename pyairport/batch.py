@@ -0,0 +1,121 @@
+"""Headless batch simulation.
+
+This module runs the simulation over a time range as fast as possible,
+without any display (Qt is never imported), and writes the conflict
+events, the taxi times of the flights and hourly statistics as CSV or
+JSON files, for regression or capacity studies."""
+
+import argparse
+import json
+
+import airport
+import simulation
+import tables
+import traffic
+
+CONFLICT_FIELDS = ('first', 'second', 'start', 'end', 'duration')
+FLIGHT_FIELDS = ('call_sign', 'type', 'start', 'runway_time', 'end', 'taxi_time', 'conflict_steps')
+HOUR_FIELDS = ('hour', 'arrivals', 'departures', 'max_moving', 'mean_moving',
+               'conflict_steps', 'new_conflicts')
+
+
+def key(flight):
+    """key(Flight) return (str, int)
+    return an identifier of 'flight' that does not depend on its materialisation"""
+    return flight.call_sign, flight.start_t
+
+
+def run(sim, t1, t2):
+    """run(simulation.Simulation, int, int) return (dict list, dict list, dict list)
+    steps 'sim' over the time steps [t1, t2[ and return the conflict events
+    (pairs of flights in conflict over consecutive time steps), the flights
+    moving during the range with their taxi time and the hourly statistics"""
+    flights, steps = {}, {}
+    events, running = [], {}
+    hours = {}
+    for t in range(t1, t2):
+        sim.set_time(t)
+        pairs = {}
+        for (fi, fj) in sim.conflict_pairs(t):
+            pairs[tuple(sorted((key(fi), key(fj))))] = None
+        # each flight counts once per time step, whatever its number of conflicts
+        for k in {k for pair in pairs for k in pair}:
+            steps[k] = steps.get(k, 0) + 1
+        for pair in list(running):
+            if pair not in pairs:
+                events.append((pair, running.pop(pair), t - 1))
+        hour = hours.setdefault(t // traffic.HOUR, {'moving': [], 'conflict_steps': 0, 'new_conflicts': 0})
+        hour['moving'].append(len(sim.current_flights))
+        hour['conflict_steps'] += bool(pairs)
+        for pair in pairs:
+            if pair not in running:
+                running[pair] = t
+                hour['new_conflicts'] += 1
+        for f in sim.current_flights:
+            flights.setdefault(key(f), f)
+    events.extend((pair, start, t2 - 1) for (pair, start) in running.items())
+
+    conflicts = [{'first': '{} {}'.format(p[0][0], traffic.hms(p[0][1])),
+                  'second': '{} {}'.format(p[1][0], traffic.hms(p[1][1])),
+                  'start': traffic.hms(start), 'end': traffic.hms(end),
+                  'duration': (end - start + 1) * traffic.STEP}
+                 for (p, start, end) in sorted(events, key=lambda e: (e[1], e[0]))]
+    flight_rows = []
+    for f in sorted(flights.values(), key=lambda f: (f.start_t, f.call_sign)):
+        arrival = f.type == traffic.Movement.ARR
+        flight_rows.append({'call_sign': f.call_sign, 'type': f.type.name if f.type else None,
+                            'start': traffic.hms(f.start_t), 'runway_time': traffic.hms(f.rwy_t),
+                            'end': traffic.hms(f.end_t),
+                            'taxi_time': ((f.end_t - f.rwy_t) if arrival else (f.rwy_t - f.start_t)) * traffic.STEP,
+                            'conflict_steps': steps.get(key(f), 0)})
+    hour_rows = []
+    for (h, hour) in sorted(hours.items()):
+        starting = [f for f in flights.values() if f.start_t // traffic.HOUR == h]
+        hour_rows.append({'hour': '{:02d}h00'.format(h),
+                          'arrivals': sum(f.type == traffic.Movement.ARR for f in starting),
+                          'departures': sum(f.type == traffic.Movement.DEP for f in starting),
+                          'max_moving': max(hour['moving']),
+                          'mean_moving': round(sum(hour['moving']) / len(hour['moving']), 2),
+                          'conflict_steps': hour['conflict_steps'],
+                          'new_conflicts': hour['new_conflicts']})
+    return conflicts, flight_rows, hour_rows
+
+
+if __name__ == "__main__":
+    # Command line options
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--airport', default="DATA/lfpg_map.txt", help="airport description file")
+    parser.add_argument('--traffic', default="DATA/lfpg_flights.txt", help="traffic file")
+    parser.add_argument('--start', default="00:00:00", help="first time (HH:MM:SS)")
+    parser.add_argument('--end', default="24:00:00", help="end time, excluded (HH:MM:SS)")
+    parser.add_argument('--format', choices=('csv', 'json'), default='csv', help="output format")
+    parser.add_argument('--output', default="batch",
+                        help="output prefix (PREFIX_conflicts.csv, PREFIX_flights.csv and "
+                             "PREFIX_hours.csv, or PREFIX.json)")
+    parser.add_argument('--stream', action='store_true',
+                        help="only read the flights around the current time (for long traffic files)")
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help="parse the traffic file with N processes when it is not cached")
+    args = parser.parse_args()
+
+    # Load files
+    apt = airport.from_file(args.airport)
+    if args.stream:
+        flights = traffic.LazyTraffic(apt, args.traffic)
+    else:
+        flights = traffic.from_file(apt, args.traffic, args.workers)
+
+    # run the simulation
+    t1, t2 = traffic.time_step(args.start), traffic.time_step(args.end)
+    sim = simulation.Simulation(apt, flights, init_time=t1)
+    conflicts, flight_rows, hour_rows = run(sim, t1, t2)
+    print(len(conflicts), "conflicts,", len(flight_rows), "flights")
+
+    # write the results
+    if args.format == 'json':
+        with open(args.output + '.json', 'w') as file:
+            json.dump({'conflicts': conflicts, 'flights': flight_rows, 'hours': hour_rows}, file, indent=1)
+    else:
+        tables.write_csv(args.output + '_conflicts.csv', CONFLICT_FIELDS, conflicts)
+        tables.write_csv(args.output + '_flights.csv', FLIGHT_FIELDS, flight_rows)
+        tables.write_csv(args.output + '_hours.csv', HOUR_FIELDS, hour_rows)
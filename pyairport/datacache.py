@@ -0,0 +1,76 @@
+"""Binary cache of the data files.
+
+The columns of arrays parsed from a text data file are saved in a
+'.npz' file next to it, and are reloaded instead of parsing the text
+file again as long as this file is unchanged (same modification time
+and size, or else same content hash)."""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+SUFFIX = '.cache.npz'  # Suffix of the cache file added to the data file name
+VERSION = 1  # Version of the cache format, to be increased when columns change
+
+
+def digest(filenames, extra=''):
+    """digest(str list, str) return str
+    return the hash of the content of the files 'filenames' and of 'extra'"""
+    sha = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as file:
+            sha.update(file.read())
+    sha.update(extra.encode())
+    return sha.hexdigest()
+
+
+def load(filename, extra='', suffix=SUFFIX):
+    """load(str, str, str) return None | (str -> array) dict
+    return the cached columns of the data file 'filename' (parsed with the
+    settings described by 'extra'), or None if they are missing or outdated
+    ('suffix' allows to keep several caches of the same data file);
+    an unreadable cache file (truncated, empty...) is also ignored"""
+    try:
+        with np.load(filename + suffix) as data:
+            columns = {key: data[key] for key in data.files}
+    except Exception:
+        return None
+    stat = os.stat(filename)
+    key = [columns.pop(name, None) for name in ('version', 'extra', 'mtime', 'size', 'digest')]
+    if key[:2] != [VERSION, extra]:
+        return None
+    if key[2:4] != [stat.st_mtime_ns, stat.st_size] and key[4] != digest([filename]):
+        return None
+    return columns
+
+
+def save(filename, columns, extra='', suffix=SUFFIX):
+    """save(str, (str -> array) dict, str, str): saves the columns of arrays
+    parsed from the data file 'filename' in its cache file"""
+    stat = os.stat(filename)
+    write(filename + suffix, version=VERSION, extra=extra, mtime=stat.st_mtime_ns,
+          size=stat.st_size, digest=digest([filename]), **columns)
+
+
+def write(filename, **arrays):
+    """write(str, **array): saves 'arrays' in the '.npz' file 'filename', written
+    in a temporary file of the same directory then renamed, so that a reader
+    (another process, or the next run after a crash) never sees a partial file"""
+    try:
+        fd, temp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(filename) + '.',
+                                    dir=os.path.dirname(os.path.abspath(filename)))
+    except OSError as error:
+        print(error)
+        return
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temp, filename)
+    except OSError as error:
+        print(error)
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
@@ -0,0 +1,118 @@
+"""Conflict detection engine.
+
+This module detects the conflicts between flights without testing
+every pair of flights: the positions are bucketed into a uniform grid
+whose cells are 'traffic.SEP' wide, so that only flights in neighbouring
+cells are compared, and the flights lying in each runway corridor are
+indexed separately. All the time steps of a window are processed at once
+from a single batch lookup of the positions."""
+
+import numpy as np
+
+import geometry
+import traffic
+
+# Neighbouring cells (half of them, so that each pair of cells is visited once)
+NEIGHBOURS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def join(left, right, order=None):
+    """join(int array, int array, int array) return (int array, int array)
+    return the indices (i, j) of all the pairs such that left[i] == right[j],
+    'order' being the sorting permutation of 'right' if already known"""
+    if order is None:
+        order = np.argsort(right, kind='stable')
+    lo = np.searchsorted(right[order], left, 'left')
+    counts = np.searchsorted(right[order], left, 'right') - lo
+    starts = np.cumsum(counts) - counts
+    i = np.repeat(np.arange(len(left)), counts)
+    j = order[np.repeat(lo - starts, counts) + np.arange(counts.sum())]
+    return i, j
+
+
+def close_pairs(xy, steps, sep):
+    """close_pairs(int array (m, 2), int array (m,), int) return (int array, int array)
+    return the pairs of entries (positions 'xy' at time steps 'steps')
+    that are at the same time step and closer than 'sep'"""
+    cells = xy // sep
+    cells -= cells.min(axis=0) - 1
+    span = cells.max(axis=0) + 2
+    keys = (steps.astype(np.int64) * span[0] + cells[:, 0]) * span[1] + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    pairs = []
+    for (di, dj) in NEIGHBOURS:
+        i, j = join(keys + di * span[1] + dj, keys, order)
+        if (di, dj) == (0, 0):
+            i, j = i[i < j], j[i < j]
+        pairs.append((i, j))
+    i = np.concatenate([p[0] for p in pairs])
+    j = np.concatenate([p[1] for p in pairs])
+    d2 = ((xy[i].astype(np.int64) - xy[j]) ** 2).sum(axis=1)
+    keep = d2 < sep ** 2
+    return i[keep], j[keep]
+
+
+def runway_pairs(flights, xy, owners, steps, use):
+    """runway_pairs(Flight list, int array (m, 2), int array (m,), int array (m,), bool array (m,))
+    return (int array, int array)
+    return the pairs of entries (positions 'xy' of the flights of index 'owners'
+    at time steps 'steps') where the first one uses its runway, as told by 'use',
+    while the second one is in the corridor of this runway at the same time step"""
+    entries = np.arange(len(xy))
+    pairs = []
+    for runway in set(f.runway for f in flights):
+        users = np.array([f.runway is runway for f in flights])
+        users = entries[use & users[owners]]
+        if len(users) == 0:
+            continue
+        corridor = entries[geometry.seg_dists(xy, *runway.coords) <= traffic.RWY_SEP]
+        i, j = join(steps[users], steps[corridor])
+        pairs.append((users[i], corridor[j]))
+    if not pairs:
+        return entries[:0], entries[:0]
+    i = np.concatenate([p[0] for p in pairs])
+    j = np.concatenate([p[1] for p in pairs])
+    keep = owners[i] != owners[j]
+    return i[keep], j[keep]
+
+
+def conflict_pairs(flights, t1, t2, runways=True):
+    """conflict_pairs(Flight list, int, int, bool) return (int array, int array, int array)
+    return the indices in 'flights' of all the conflicting pairs
+    between time steps 't1' and 't2', and the time steps of these conflicts
+    (flights are only compared at the time steps where both are moving),
+    without the runway conflicts unless 'runways' is set"""
+    empty = np.zeros(0, dtype=np.int64)
+    if len(flights) < 2 or t2 < t1:
+        return empty, empty, empty
+    xy = traffic.track(flights, t1, t2)
+    start_t = np.array([f.start_t for f in flights]).reshape(-1, 1)
+    end_t = np.array([f.end_t for f in flights]).reshape(-1, 1)
+    alive = (start_t <= np.arange(t1, t2 + 1)) & (np.arange(t1, t2 + 1) < end_t)
+    if not alive.any():
+        return empty, empty, empty
+    # one entry per position of a flight still moving
+    owners, steps = np.nonzero(alive)
+    xy = xy[alive]
+    i1, j1 = close_pairs(xy, steps, traffic.SEP)
+    if runways:
+        use = traffic.use_runways(flights, t1, t2)[alive]
+        i2, j2 = runway_pairs(flights, xy, owners, steps, use)
+    else:
+        i2, j2 = i1[:0], j1[:0]
+    i, j = np.concatenate((i1, i2)), np.concatenate((j1, j2))
+    return owners[i], owners[j], steps[i] + t1
+
+
+def detect(flights, t):
+    """detect(Flight list, int) return (Flight -> None) dict
+    return the dictionary of the flights that conflicts at time step 't'"""
+    return detect_in(flights, t, t)
+
+
+def detect_in(flights, t1, t2):
+    """detect_in(Flight list, int, int) return (Flight -> None) dict
+    return the dictionary of the flights that conflicts
+    between time steps 't1' and 't2' (same result as 'traffic.detect_in')"""
+    i, j, _ = conflict_pairs(flights, t1, t2)
+    return {flights[k]: None for k in np.unique(np.concatenate((i, j)))}
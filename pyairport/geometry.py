@@ -1,5 +1,7 @@
 """Geometry classes and utilities."""
 
+import numpy as np
+
 
 class Point(object):
     """Meters coordinates, with attributes x, y: int"""
@@ -90,9 +92,11 @@ class Vector:
         
 
 class PolyLine(object):
-    def __init__(self, coords):
-        self.length = sum(pi.distance(coords[i - 1])
-                          for i, pi in enumerate(coords[1:]))
+    def __init__(self, coords, length=None):
+        if length is None:
+            length = sum(pi.distance(coords[i - 1])
+                         for i, pi in enumerate(coords[1:]))
+        self.length = length
         self.coords = coords
 
     def __repr__(self):
@@ -104,3 +108,15 @@ class PolyLine(object):
 
     def __len__(self):
         return len(self.coords)
+
+
+def seg_dists(xy, a, b):
+    """seg_dists(array (n, 2), Point, Point) return float array (n,)
+    vectorised version of Point.seg_dist for the points 'xy'"""
+    xy = np.asarray(xy, dtype=float)
+    ab = np.array([b.x - a.x, b.y - a.y], dtype=float)
+    ap, bp = xy - (a.x, a.y), xy - (b.x, b.y)
+    norm_ap, norm_bp = np.sqrt((ap ** 2).sum(axis=1)), np.sqrt((bp ** 2).sum(axis=1))
+    det = np.abs(ab[0] * ap[:, 1] - ab[1] * ap[:, 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(ap @ ab <= 0, norm_ap, np.where(bp @ ab >= 0, norm_bp, det / norm_ap))
@@ -2,13 +2,115 @@
     Class displaying flight information
     wraps a widget designed with Qt Designer
 """
-from PyQt5.QtCore import pyqtSlot
-from PyQt5.QtWidgets import QWidget, QListWidgetItem
+from PyQt5.QtCore import pyqtSlot, Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtWidgets import QWidget
 
+import simulation
 import traffic
 from ui_flightInspector import Ui_flightInspector
 
 
+class FlightIndex:
+    """Indexes by attribute of the flights currently listed, with the following attributes:
+    - by_type: (Movement -> Flight set) dict (flights by movement type)
+    - by_runway: (str -> Flight set) dict (flights by runway name)
+    - by_slot: (bool -> Flight set) dict (flights with or without a slot)
+    - by_text: (str -> Flight set) dict (flights by substring of their call sign)
+    Each flight is added or removed in constant time (for a bounded call sign length)."""
+
+    def __init__(self):
+        self.by_type = {}
+        self.by_runway = {}
+        self.by_slot = {True: set(), False: set()}
+        self.by_text = {}
+
+    def keys(self, flight):
+        """keys(Flight) return (dict, key) list
+        return the index entries of 'flight'"""
+        call_sign = flight.call_sign
+        substrings = {call_sign[i:j] for i in range(len(call_sign)) for j in range(i + 1, len(call_sign) + 1)}
+        return ([(self.by_type, flight.type), (self.by_runway, flight.runway.name),
+                 (self.by_slot, flight.slot is not None)] +
+                [(self.by_text, text) for text in substrings])
+
+    def add(self, flight):
+        """add(Flight): adds 'flight' to the indexes"""
+        for (index, key) in self.keys(flight):
+            index.setdefault(key, set()).add(flight)
+
+    def remove(self, flight):
+        """remove(Flight): removes 'flight' from the indexes"""
+        for (index, key) in self.keys(flight):
+            index[key].discard(flight)
+
+    def select(self, flight_type, runway, slot, text):
+        """select(None | Movement, None | str, None | bool, str) return Flight set
+        return the flights matching all the criteria (None or '' meaning any value)"""
+        sets = [index.get(key, set())
+                for (index, key) in ((self.by_type, flight_type), (self.by_runway, runway),
+                                     (self.by_slot, slot), (self.by_text, text))
+                if key is not None and key != '']
+        if not sets:
+            return self.by_slot[True] | self.by_slot[False]
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+
+class FlightListModel(QAbstractListModel):
+    """List of the filtered flights shown by the inspector, with the following attributes:
+    - flights: Flight list (the flights, one per row, in no particular order)
+    - rows: (Flight -> int) dict (row of each flight)
+    A flight is removed by moving the last one in its row, in constant time."""
+
+    def __init__(self):
+        super().__init__()
+        self.flights = []
+        self.rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.flights)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role == Qt.DisplayRole:
+            return self.flights[index.row()].call_sign
+        return None
+
+    def flight(self, index):
+        """flight(QModelIndex) return None | Flight: flight shown at 'index'"""
+        return self.flights[index.row()] if index.isValid() else None
+
+    def add(self, flights):
+        """add(Flight list): appends the flights not yet in the list"""
+        flights = [f for f in flights if f not in self.rows]
+        if flights:
+            self.beginInsertRows(QModelIndex(), len(self.flights), len(self.flights) + len(flights) - 1)
+            for f in flights:
+                self.rows[f] = len(self.flights)
+                self.flights.append(f)
+            self.endInsertRows()
+
+    def clear(self):
+        """clear(): removes all the flights"""
+        self.beginResetModel()
+        self.flights, self.rows = [], {}
+        self.endResetModel()
+
+    def remove(self, flight):
+        """remove(Flight): removes 'flight' from the list if it is there"""
+        row = self.rows.pop(flight, None)
+        if row is None:
+            return
+        last = len(self.flights) - 1
+        if row != last:
+            moved = self.flights[last]
+            self.flights[row] = moved
+            self.rows[moved] = row
+            self.dataChanged.emit(self.index(row), self.index(row))
+        self.beginRemoveRows(QModelIndex(), last, last)
+        self.flights.pop()
+        self.endRemoveRows()
+
+
 class Inspector(QWidget):
     """ Widget displaying information about a Flight """
 
@@ -23,29 +125,35 @@ class Inspector(QWidget):
         # sets up the widget created with Qt Designer and pyuic
         self.ui_flightInspector.setupUi(self)
 
-        # creates a flights list
-        self.flights = []
-        # creates filtered flights sets
-        self.filtered_flights_slot = set()  # flights filtered only by slot
-        self.filtered_flights_type = set()  # flights filtered only by type
-        self.filtered_flights_runway = set()  # flights filtered only by runway
-        self.filtered_flights_callsign = set()  # flights filtered only by a substring in callsign
-        self.filtered_flights = []  # global list (intersection of the filters)
+        # creates the set of the current flights and their indexes
+        self.flights = set()
+        self.index = FlightIndex()
+        # creates the current filter criteria (None or '' meaning all)
+        self.type_filter = None  # Movement
+        self.runway_filter = None  # runway name
+        self.slot_filter = None  # with slot or not
+        self.callsign_filter = ''  # substring in callsign
+        # creates the model of the list of the filtered flights
+        self.filtered_flights = FlightListModel()
+        self.ui_flightInspector.list_flights.setModel(self.filtered_flights)
+        self.inspected = None  # inspected flight
+        self.updating = False  # is the list being updated ?
 
         # populates the 'filter by type' combobox
-        types = ["All", "Departures", "Arrivals"]
-        self.ui_flightInspector.comboBox_type.addItems(types)
+        self.types = [None, traffic.Movement.DEP, traffic.Movement.ARR]
+        self.ui_flightInspector.comboBox_type.addItems(["All", "Departures", "Arrivals"])
 
-        # populates the 'filter by runway' combobox
-        runways = ["All", "09L-27R", "09R-27L", "08L-26R", "08R-26L"]  # todo adapter tous aéroports
-        self.ui_flightInspector.comboBox_runway.addItems(runways)
+        # populates the 'filter by runway' combobox with the runways of the airport
+        self.runways = [None] + [runway.name for runway in self.airport.runways]
+        self.ui_flightInspector.comboBox_runway.addItems(["All"] + self.runways[1:])
 
-        # listens newPlotsAvailable signal on radarview
+        # listens newPlotsAvailable signal on radarview, after getting the current flights
+        self.update_flights(simulation.FlightsDelta(the_radarview.snapshot.flights, (), True))
         self.radarview.flight_list_changed_signal.connect(self.update_flights)
         # listens inspectionAsked signal on radarview
         self.radarview.ask_inspection_signal.connect(self.inspect)
         # listens clicks on items of the flight list in ui_flightInspector
-        self.ui_flightInspector.list_flights.currentTextChanged.connect(self.ask_inspection)
+        self.ui_flightInspector.list_flights.selectionModel().currentChanged.connect(self.ask_inspection)
         # listens changes on the 'filter by slot' group of radiobuttons
         self.ui_flightInspector.radioButton_slot.toggled.connect(self.filter_by_slot)
         self.ui_flightInspector.radioButton_noslot.toggled.connect(self.filter_by_slot)
@@ -59,21 +167,33 @@ class Inspector(QWidget):
 
         self.show()
 
-    @pyqtSlot(list)
-    def update_flights(self, flight_list):
-        # populates the flight list with the current flights managed by radarview
-        self.flights = flight_list
-        # update the filtered flight sets according to the existing criteria and the new flight list
-        # by simulating an action on all the filter widgets
-        self.ui_flightInspector.radioButton_slot.toggled.emit(self.ui_flightInspector.radioButton_slot.isChecked())
-        self.ui_flightInspector.radioButton_noslot.toggled.emit(self.ui_flightInspector.radioButton_noslot.isChecked())
-        self.ui_flightInspector.radioButton_slotornot.toggled.emit(
-            self.ui_flightInspector.radioButton_slotornot.isChecked())
-        self.ui_flightInspector.comboBox_type.currentIndexChanged.emit(
-            self.ui_flightInspector.comboBox_type.currentIndex())
-        self.ui_flightInspector.comboBox_runway.currentIndexChanged.emit(
-            self.ui_flightInspector.comboBox_runway.currentIndex())
-        self.ui_flightInspector.lineEdit_callsign.textChanged.emit(self.ui_flightInspector.lineEdit_callsign.text())
+    @pyqtSlot(object)
+    def update_flights(self, delta):
+        # only the flights that entered or left (simulation.FlightsDelta) are indexed and filtered
+        self.updating = True
+        if delta.resync:
+            self.flights = set()
+            self.index = FlightIndex()
+            self.filtered_flights.clear()
+        for flight in delta.removed:
+            if flight in self.flights:
+                self.flights.remove(flight)
+                self.index.remove(flight)
+                self.filtered_flights.remove(flight)
+        entered = [flight for flight in delta.added if flight not in self.flights]
+        for flight in entered:
+            self.flights.add(flight)
+            self.index.add(flight)
+        self.filtered_flights.add([flight for flight in entered if self.matches(flight)])
+        self.updating = False
+        self.select_inspected()
+
+    def matches(self, flight):
+        """matches(Flight) return bool: tells if 'flight' meets the current criteria"""
+        return ((self.type_filter is None or flight.type == self.type_filter) and
+                (self.runway_filter is None or flight.runway.name == self.runway_filter) and
+                (self.slot_filter is None or (flight.slot is not None) == self.slot_filter) and
+                self.callsign_filter in flight.call_sign)
 
     @pyqtSlot(traffic.Flight)
     def inspect(self, flight):
@@ -95,91 +215,56 @@ class Inspector(QWidget):
         self.ui_flightInspector.label_qfu.setText(qfu)
         self.ui_flightInspector.label_time.setText(time)
         self.ui_flightInspector.label_slot.setText(slot)
+        self.inspected = flight
+        self.select_inspected()
 
-    @pyqtSlot(str)
-    def ask_inspection(self, current_text):
-        for flight in self.filtered_flights:
-            if flight.call_sign == current_text:
-                self.radarview.ask_inspection_signal.emit(flight)
-                break
+    def select_inspected(self):
+        """makes the inspected flight the current item of the list, or none if it is
+        not shown (the current row is moved by the list updates)"""
+        row = self.filtered_flights.rows.get(self.inspected)
+        index = QModelIndex() if row is None else self.filtered_flights.index(row)
+        if self.ui_flightInspector.list_flights.currentIndex() != index:
+            self.ui_flightInspector.list_flights.setCurrentIndex(index)
+
+    @pyqtSlot('QModelIndex', 'QModelIndex')
+    def ask_inspection(self, current, previous):
+        # the current row changes of the list updates are not clicks
+        flight = self.filtered_flights.flight(current)
+        if not self.updating and flight is not None and flight is not self.inspected:
+            self.radarview.ask_inspection_signal.emit(flight)
 
     def filter_flights(self):
-        filtered_set = self.filtered_flights_slot.intersection(
-            self.filtered_flights_type,
-            self.filtered_flights_runway,
-            self.filtered_flights_callsign)
-        filtered_list = list(filtered_set)
-        self.filtered_flights = filtered_list
-
-    def display_filtered_flights(self):
-        current_callsigns = set([self.ui_flightInspector.list_flights.item(i).text()
-                                 for i in range(self.ui_flightInspector.list_flights.count())])
-        new_callsigns = set([my_flight.call_sign for my_flight in self.filtered_flights])
-        # removes the flights who left
-        for callsign in current_callsigns - new_callsigns:
-            for i in range(self.ui_flightInspector.list_flights.count()):
-                if self.ui_flightInspector.list_flights.item(i).text() == callsign:
-                    self.ui_flightInspector.list_flights.takeItem(i)
-                    break
-        # adds the new flights
-        for callsign in new_callsigns - current_callsigns:
-            item = QListWidgetItem(self.ui_flightInspector.list_flights)
-            item.setText(callsign)
-            # self.ui_flightInspector.list_flights.sortItems()  # if really need to sort but changing list so focus loss
+        """updates the list with the flights meeting the current criteria"""
+        self.updating = True
+        selected = self.index.select(self.type_filter, self.runway_filter, self.slot_filter, self.callsign_filter)
+        for flight in [flight for flight in self.filtered_flights.flights if flight not in selected]:
+            self.filtered_flights.remove(flight)
+        self.filtered_flights.add(list(selected))
+        self.updating = False
+        self.select_inspected()
 
     @pyqtSlot()
     def filter_by_slot(self):
         if self.sender().isChecked():
-            filtered = []
             if self.sender() == self.ui_flightInspector.radioButton_slot:
-                filtered = [flight for flight in self.flights if flight.slot is not None]
+                self.slot_filter = True
             elif self.sender() == self.ui_flightInspector.radioButton_noslot:
-                filtered = [flight for flight in self.flights if flight.slot is None]
-            elif self.sender() == self.ui_flightInspector.radioButton_slotornot:
-                filtered = self.flights
-            self.filtered_flights_slot = set(filtered)
+                self.slot_filter = False
+            else:
+                self.slot_filter = None
             self.filter_flights()
-            self.display_filtered_flights()
 
     @pyqtSlot(int)
     def filter_by_type(self, i):
-        if i == 1:
-            filtered = [flight for flight in self.flights if flight.type == traffic.Movement.DEP]
-        elif i == 2:
-            filtered = [flight for flight in self.flights if flight.type == traffic.Movement.ARR]
-        else:
-            filtered = self.flights
-        self.filtered_flights_type = set(filtered)
+        self.type_filter = self.types[i] if 0 <= i < len(self.types) else None
         self.filter_flights()
-        self.display_filtered_flights()
 
     @pyqtSlot(int)
     def filter_by_runway(self, i):
-        if i == 1:
-            filtered = [flight
-                        for flight in self.flights
-                        if flight.runway.name == "09L-27R"]
-        elif i == 2:
-            filtered = [flight
-                        for flight in self.flights
-                        if flight.runway.name == "09R-27L"]
-        elif i == 3:
-            filtered = [flight
-                        for flight in self.flights
-                        if flight.runway.name == "08L-26R"]
-        elif i == 4:
-            filtered = [flight
-                        for flight in self.flights
-                        if flight.runway.name == "08R-26L"]
-        else:
-            filtered = self.flights
-        self.filtered_flights_runway = set(filtered)
+        self.runway_filter = self.runways[i] if 0 <= i < len(self.runways) else None
         self.filter_flights()
-        self.display_filtered_flights()
 
     @pyqtSlot(str)
     def filter_by_callsign(self, text):
-        filtered = [flight for flight in self.flights if text.upper() in flight.call_sign]
-        self.filtered_flights_callsign = set(filtered)
+        self.callsign_filter = text.upper()
         self.filter_flights()
-        self.display_filtered_flights()
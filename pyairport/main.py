@@ -1,55 +1,183 @@
 """Main module for the Python Airport code"""
 
-from PyQt5 import QtWidgets, QtCore
-
-import airport
-import inspector
-import radarview
-import secondview
-import simulation
-import traffic
+import argparse
+import concurrent.futures
+import time
+import traceback
 
 APT_FILE = ("DATA/lfpg_map.txt", "DATA/lfpo_map.txt")
 PLN_FILE = ("DATA/lfpg_flights.txt", "DATA/lfpo_flights.txt")
+POLL_DELAY = 20  # Delay between two checks of the background loading (milliseconds)
 
-if __name__ == "__main__":
-    # Load files
-    # choice = 0 if input("1: Roissy / [2: Orly] ? ") == '1' else 1
-    choice = 0
+
+class StartupProfile:
+    """Durations of the startup phases, with the following attributes:
+    - start: float (time of the start of the program)
+    - last: float (end time of the last phase of the main thread)
+    - phases: (str, float, float) list (name, duration and end time of each phase,
+      from the start of the program)"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, name):
+        """mark(str): ends now the phase 'name' of the main thread"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last, now - self.start))
+        self.last = now
+
+    def add(self, name, begin):
+        """add(str, float): ends now the phase 'name' of a background
+        thread, that began at time 'begin'"""
+        now = time.perf_counter()
+        self.phases.append((name, now - begin, now - self.start))
+
+    def report(self):
+        """report() return str: formatted durations of the startup phases"""
+        lines = ["Startup profile:"]
+        lines.extend("  {:<24} {:6.3f} s  (at {:6.3f} s)".format(*phase)
+                     for phase in sorted(self.phases, key=lambda phase: phase[2]))
+        return '\n'.join(lines)
+
+
+def load_data(choice, stream, workers, with_timeline, trail_length, profile):
+    """load_data(int, bool, int, bool, int, StartupProfile) return simulation.Simulation
+    loads the airport and the traffic files 'choice' (and the conflict timeline
+    if asked) and creates the simulation showing comets of 'trail_length'
+    positions, recording the durations in 'profile'"""
+    t = time.perf_counter()
+    import airport
+    import simulation
+    import timeline
+    import traffic
+    profile.add("import modules (thread)", t)
+    t = time.perf_counter()
     apt = airport.from_file(APT_FILE[choice])
-    flights = traffic.from_file(apt, PLN_FILE[choice])
+    profile.add("parse airport (thread)", t)
+    t = time.perf_counter()
+    if stream:
+        flights = traffic.LazyTraffic(apt, PLN_FILE[choice])
+    else:
+        flights = traffic.from_file(apt, PLN_FILE[choice], workers)
+    profile.add("parse traffic (thread)", t)
+    t = time.perf_counter()
+    # compute or reload the conflict timeline if asked
+    conflict_timeline = (timeline.from_files(APT_FILE[choice], PLN_FILE[choice], flights)
+                         if with_timeline else None)
+    sim = simulation.Simulation(apt, flights, conflict_timeline=conflict_timeline, trail_length=trail_length)
+    profile.add("simulation (thread)", t)
+    return sim
 
-    # create the simulation
-    sim = simulation.Simulation(apt, flights)
 
-    # Initialize Qt
-    app = QtWidgets.QApplication([])
+if __name__ == "__main__":
+    profile = StartupProfile()
 
-    # create the radar view and the time navigation interface
-    rad = radarview.RadarView(sim)
-    rad.move(10, 10)
+    # Command line options
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--timeline', action='store_true',
+                        help="precompute (or reload) the conflicts of the whole day")
+    parser.add_argument('--stream', action='store_true',
+                        help="only read the flights around the current time (for long traffic files)")
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help="parse the traffic file with N processes when it is not cached")
+    parser.add_argument('--trail', type=int, default=5, metavar='N',
+                        help="number of positions shown in the comet of each aircraft")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print the duration of each startup phase")
+    args = parser.parse_args()
+    if args.timeline and args.stream:
+        parser.error("--timeline needs the whole traffic and cannot be used with --stream")
+    if args.trail < 1:
+        parser.error("--trail must be at least 1")
 
-    # create the inspector
-    insp = inspector.Inspector(rad)
+    # choice = 0 if input("1: Roissy / [2: Orly] ? ") == '1' else 1
+    choice = 0
+
+    # Load files in the background while the window shows up
+    loader = concurrent.futures.ThreadPoolExecutor(1)
+    loading = loader.submit(load_data, choice, args.stream, args.workers, args.timeline,
+                            args.trail, profile)
+    profile.mark("command line")
 
-    # create a QDockWidget for the inspector
-    insp_dock = QtWidgets.QDockWidget()
-    insp_dock.setWidget(insp)
+    # Initialize Qt (only imported now that the loading is started)
+    from PyQt5 import QtWidgets, QtCore
+
+    app = QtWidgets.QApplication([])
+    profile.mark("import Qt")
 
-    # create the QMainWindow and add both widgets
+    # create the QMainWindow, empty until the files are loaded
     win = QtWidgets.QMainWindow()
     win.setWindowTitle("AirPort Sim Qt MainWindow & Dock")
-    win.setCentralWidget(rad)
-    win.addDockWidget(QtCore.Qt.DockWidgetArea(1), insp_dock)
+    loading_label = QtWidgets.QLabel("Loading " + APT_FILE[choice] + "...")
+    loading_label.setAlignment(QtCore.Qt.AlignCenter)
+    win.setCentralWidget(loading_label)
     # win.resize(1000, 600)
     # win.show()
     win.showMaximized()
+    app.processEvents()
+    profile.mark("first frame")
+
+    def build_views():
+        """creates the radar view and the inspector once the files are loaded
+        (or reports the loading error and quits)"""
+        try:
+            sim = loading.result()
+        except Exception as error:
+            # an exception must not escape a Qt slot, which would abort the process
+            traceback.print_exception(type(error), error, error.__traceback__)
+            QtWidgets.QMessageBox.critical(win, "Loading error",
+                                           "The data files could not be loaded:\n{}".format(error))
+            app.quit()
+            return
+        finally:
+            loader.shutdown()
+        profile.mark("wait for the files")
+
+        # the GUI modules are only needed from now on
+        import inspector
+        import radarview
+        import simulation
+        profile.mark("import GUI modules")
+
+        # create the radar view and the time navigation interface
+        rad = radarview.RadarView(sim)
+        rad.move(10, 10)
+
+        # create the inspector
+        insp = inspector.Inspector(rad)
+
+        # create a QDockWidget for the inspector
+        insp_dock = QtWidgets.QDockWidget()
+        insp_dock.setWidget(insp)
+
+        # add both widgets to the QMainWindow
+        win.setCentralWidget(rad)
+        win.addDockWidget(QtCore.Qt.DockWidgetArea(1), insp_dock)
+        profile.mark("scene build")
+        app.processEvents()
+        profile.mark("first traffic paint")
+
+        # create the second view
+        # import secondview
+        # second_view = secondview.SecondView(main_window.scene)
+        # second_view.move(300, 300)
+
+        print(simulation.SHORTCUTS)
+        if args.profile_startup:
+            print(profile.report())
+
+    # check the background loading until it is done
+    poll = QtCore.QTimer()
 
-    # create the second view
-    # second_view = secondview.SecondView(main_window.scene)
-    # second_view.move(300, 300)
+    def check_loading():
+        if loading.done():
+            poll.stop()
+            build_views()
 
-    print(simulation.SHORTCUTS)
+    poll.timeout.connect(check_loading)
+    poll.start(POLL_DELAY)
 
     # enter the main loop
     app.exec_()
@@ -0,0 +1,244 @@
+"""Runway occupancy of a traffic sample.
+
+This module computes once, for each runway of the airport, the time
+intervals during which each flight lies in the runway corridor and the
+ones during which each flight uses its runway, and indexes them by
+beginning time (see traffic.IntervalIndex), so that the runway conflicts
+are found as overlaps of intervals instead of distances computed at each
+time step. A report of the slot deviations, the runway throughput and
+the departure queues is built on top of it in a single pass over the day."""
+
+import argparse
+import json
+
+import numpy as np
+
+import airport
+import geometry
+import tables
+import traffic
+
+SLOT_FIELDS = ('call_sign', 'runway', 'slot', 'take_off', 'deviation', 'in_window')
+RUNWAY_FIELDS = ('runway', 'hour', 'departures', 'arrivals', 'occupied', 'max_queue', 'mean_queue')
+
+
+class Intervals:
+    """Time intervals [start, end[ of some flights, with the following attributes:
+    - flights: int array (store index of the flight of each interval)
+    - start: int array (first time step of each interval)
+    - end: int array (time step following the last one of each interval)
+    - index: traffic.IntervalIndex (index of the intervals)"""
+
+    def __init__(self, flights, start, end):
+        self.flights = flights
+        self.start = start
+        self.end = end
+        self.index = traffic.IntervalIndex(start, end)
+
+    def __len__(self):
+        return len(self.start)
+
+    def between(self, t1, t2):
+        """between(int, int) return int array
+        return the sorted indices of the intervals that meet [t1, t2]"""
+        return self.index.between(t1, t2)
+
+    def overlaps(self, other):
+        """overlaps(Intervals) return (int array, int array)
+        return the indices (i, j) of all the pairs of intervals of 'self' and 'other'
+        that overlap (only the intervals of 'other' beginning less than their
+        longest duration before each interval of 'self' are tested)"""
+        index = other.index
+        lo = np.searchsorted(index.starts, self.start - index.max_duration, 'right')
+        hi = np.searchsorted(index.starts, self.end - 1, 'right')
+        counts = np.maximum(hi - lo, 0)
+        starts = np.cumsum(counts) - counts
+        i = np.repeat(np.arange(len(self)), counts)
+        j = index.by_start[np.repeat(lo - starts, counts) + np.arange(counts.sum())]
+        keep = other.end[j] > self.start[i]
+        return i[keep], j[keep]
+
+
+class RunwayOccupancy:
+    """Occupancy of the runways by the flights of a traffic sample, with the following attributes:
+    - store: traffic.TrafficStore (the traffic)
+    - runways: airport.Runway list (the runways of the airport)
+    - rank: int array (rank in 'runways' of the runway of each flight)
+    - corridor: Intervals list (intervals where the flights are in the corridor of each runway)
+    - use: Intervals list (intervals where the flights of each runway use it, see Flight.use_runway)"""
+
+    def __init__(self, store, runways):
+        self.store = store
+        self.runways = list(runways)
+        self.rank = np.array([self.runways.index(f.runway) for f in store], dtype=np.int64)
+        self.corridor = [self.corridor_intervals(runway) for runway in self.runways]
+        self.use = [self.use_intervals(rank) for rank in range(len(self.runways))]
+
+    def __repr__(self):
+        return "<occupancy.RunwayOccupancy {0} runways>".format(len(self.runways))
+
+    def corridor_intervals(self, runway):
+        """corridor_intervals(airport.Runway) return Intervals
+        return the intervals of consecutive time steps where the flights
+        are in the corridor of 'runway' (see Flight.in_runway)"""
+        store = self.store
+        inside = geometry.seg_dists(store.xy, *runway.coords) <= traffic.RWY_SEP
+        owners = np.repeat(np.arange(len(store)), np.diff(store.offsets))
+        # a run of positions in the corridor ends at the end of a route
+        same = np.zeros(len(inside), dtype=bool)
+        same[1:] = owners[1:] == owners[:-1]
+        first = inside.copy()
+        first[1:] &= ~(inside[:-1] & same[1:])
+        last = inside.copy()
+        last[:-1] &= ~(inside[1:] & same[1:])
+        first, last = np.flatnonzero(first), np.flatnonzero(last)
+        flights = owners[first]
+        shift = store.start_t[flights] - store.offsets[flights]
+        return Intervals(flights, first + shift, last + 1 + shift)
+
+    def use_intervals(self, rank):
+        """use_intervals(int) return Intervals
+        return the intervals where the flights of the runway of rank 'rank' use it,
+        while they are moving (see Flight.use_runway)"""
+        store = self.store
+        flights = np.flatnonzero(self.rank == rank)
+        rwy_t = np.array([store[i].rwy_t for i in flights], dtype=np.int64)
+        arrival = np.array([store[i].type == traffic.Movement.ARR for i in flights], dtype=bool)
+        start_t, end_t = store.start_t[flights], store.end_t[flights]
+        start = np.where(arrival, start_t, np.maximum(rwy_t, start_t))
+        end = np.where(arrival, np.minimum(rwy_t + 1, end_t), end_t)
+        keep = start < end
+        return Intervals(flights[keep], start[keep], end[keep])
+
+    def in_corridor(self, runway, t1, t2):
+        """in_corridor(airport.Runway, int, int) return int array
+        return the store indices of the flights in the corridor of 'runway'
+        at some time step of [t1, t2]"""
+        corridor = self.corridor[self.runways.index(runway)]
+        return np.unique(corridor.flights[corridor.between(t1, t2)])
+
+    def conflicts(self):
+        """conflicts() return (int array, int array, int array, int array)
+        return the store indices of the flights of all the runway conflicts (the
+        first one using its runway while the second one is in its corridor) and
+        the first time step of each conflict and the one following its last"""
+        found = []
+        for (use, corridor) in zip(self.use, self.corridor):
+            i, j = use.overlaps(corridor)
+            keep = use.flights[i] != corridor.flights[j]
+            i, j = i[keep], j[keep]
+            found.append((use.flights[i], corridor.flights[j],
+                          np.maximum(use.start[i], corridor.start[j]), np.minimum(use.end[i], corridor.end[j])))
+        return tuple(np.concatenate([f[k] for f in found]).astype(np.int64) for k in range(4))
+
+    def conflict_steps(self):
+        """conflict_steps() return (int array, int array, int array)
+        return the store indices of the flights of all the runway conflicts (see
+        conflicts) and their time steps, one entry per time step"""
+        first, second, start, end = self.conflicts()
+        counts = end - start
+        starts = np.cumsum(counts) - counts
+        steps = np.repeat(start - starts, counts) + np.arange(counts.sum())
+        return np.repeat(first, counts), np.repeat(second, counts), steps
+
+
+class Report:
+    """Runway statistics of a traffic sample, with the following attributes:
+    - runways: str list (the runway names)
+    - slot_flights: int array (store indices of the flights with a slot)
+    - slot_deviation: int array (rwy_t - slot of these flights, in time steps)
+    - throughput: int array (r, 2, h) (departures and arrivals of each runway each hour)
+    - occupied: int array (r, h) (time steps of each hour with a flight in each runway corridor)
+    - max_queue: int array (r, h) (longest departure queue of each runway each hour)
+    - mean_queue: float array (r, h) (mean departure queue of each runway each hour)
+    The departure queue of a runway is the number of its departures that have
+    begun to move and have not taken off yet."""
+
+    def __init__(self, occupancy):
+        store = occupancy.store
+        n_runways = len(occupancy.runways)
+        hours = max(traffic.DAY, int(store.end_t.max(initial=0)) + 1) // traffic.HOUR + 1
+        length = hours * traffic.HOUR
+        self.runways = [runway.name for runway in occupancy.runways]
+        rwy_t = np.array([f.rwy_t for f in store], dtype=np.int64)
+        slot = np.array([-1 if f.slot is None else f.slot for f in store], dtype=np.int64)
+        departure = np.array([f.type == traffic.Movement.DEP for f in store], dtype=bool)
+        self.slot_flights = np.flatnonzero(slot >= 0)
+        self.slot_deviation = (rwy_t - slot)[self.slot_flights]
+        # every count is a sum of events (+1 or -1) over the day, then one cumulative sum
+        self.throughput = np.zeros((n_runways, 2, hours), dtype=np.int64)
+        np.add.at(self.throughput, (occupancy.rank, np.where(departure, 0, 1), rwy_t // traffic.HOUR), 1)
+        queue = np.zeros((n_runways, length + 1), dtype=np.int64)
+        dep = np.flatnonzero(departure)
+        np.add.at(queue, (occupancy.rank[dep], store.start_t[dep]), 1)
+        np.add.at(queue, (occupancy.rank[dep], np.maximum(rwy_t[dep], store.start_t[dep])), -1)
+        queue = np.cumsum(queue, axis=1)[:, :length].reshape(n_runways, hours, traffic.HOUR)
+        self.max_queue = queue.max(axis=2)
+        self.mean_queue = queue.mean(axis=2)
+        occupied = np.zeros((n_runways, length + 1), dtype=np.int64)
+        for (rank, corridor) in enumerate(occupancy.corridor):
+            np.add.at(occupied[rank], corridor.start, 1)
+            np.add.at(occupied[rank], corridor.end, -1)
+        occupied = np.cumsum(occupied, axis=1)[:, :length] > 0
+        self.occupied = occupied.reshape(n_runways, hours, traffic.HOUR).sum(axis=2)
+
+    def in_window(self):
+        """in_window() return bool array
+        tells if each flight with a slot takes off within traffic.SLOT_WINDOW of it"""
+        window = traffic.SLOT_WINDOW
+        return (window[0] <= self.slot_deviation) & (self.slot_deviation <= window[1])
+
+    def slot_rows(self, store):
+        """slot_rows(traffic.TrafficStore) return dict list
+        return the slot deviation of each flight of 'store' with a slot"""
+        return [{'call_sign': store[i].call_sign, 'runway': store[i].runway.name,
+                 'slot': traffic.hms(store[i].slot), 'take_off': traffic.hms(store[i].rwy_t),
+                 'deviation': int(d) * traffic.STEP, 'in_window': bool(w)}
+                for (i, d, w) in zip(self.slot_flights.tolist(), self.slot_deviation.tolist(), self.in_window())]
+
+    def runway_rows(self):
+        """runway_rows() return dict list
+        return the hourly statistics of each runway, for the hours with some traffic"""
+        rows = []
+        for (r, name) in enumerate(self.runways):
+            for h in range(self.throughput.shape[2]):
+                if self.throughput[r, :, h].any() or self.max_queue[r, h] or self.occupied[r, h]:
+                    rows.append({'runway': name, 'hour': '{:02d}h00'.format(h),
+                                 'departures': int(self.throughput[r, 0, h]),
+                                 'arrivals': int(self.throughput[r, 1, h]),
+                                 'occupied': int(self.occupied[r, h]) * traffic.STEP,
+                                 'max_queue': int(self.max_queue[r, h]),
+                                 'mean_queue': round(float(self.mean_queue[r, h]), 2)})
+        return rows
+
+
+if __name__ == "__main__":
+    # Command line options
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--airport', default="DATA/lfpg_map.txt", help="airport description file")
+    parser.add_argument('--traffic', default="DATA/lfpg_flights.txt", help="traffic file")
+    parser.add_argument('--format', choices=('csv', 'json'), default='csv', help="output format")
+    parser.add_argument('--output', default="runways",
+                        help="output prefix (PREFIX_slots.csv and PREFIX_runways.csv, or PREFIX.json)")
+    args = parser.parse_args()
+
+    # Load files
+    apt = airport.from_file(args.airport)
+    flights = traffic.from_file(apt, args.traffic)
+
+    # index the runway occupancy and report
+    occupancy = RunwayOccupancy(flights, apt.runways)
+    report = Report(occupancy)
+    slot_rows, runway_rows = report.slot_rows(flights), report.runway_rows()
+    deviation = report.slot_deviation * traffic.STEP
+    print(len(slot_rows), "flights with a slot,", int(report.in_window().sum()), "in window,",
+          "mean deviation {:.1f} s,".format(deviation.mean() if len(deviation) else 0.),
+          len(occupancy.conflicts()[0]), "runway conflict intervals")
+
+    # write the results
+    if args.format == 'json':
+        with open(args.output + '.json', 'w') as file:
+            json.dump({'slots': slot_rows, 'runways': runway_rows}, file, indent=1)
+    else:
+        tables.write_csv(args.output + '_slots.csv', SLOT_FIELDS, slot_rows)
+        tables.write_csv(args.output + '_runways.csv', RUNWAY_FIELDS, runway_rows)
@@ -0,0 +1,192 @@
+"""Conflict-free taxi planning.
+
+This module plans the flights of a traffic sample one after the other in
+beginning time order: each flight is given a taxi route (the shortest one
+of the route table, or else its original one) and a start delay such that
+its space-time footprint does not conflict with the footprints booked by
+the flights planned before, which are stored in a reservation table
+indexed by time step and grid cell. The planned flights are written as a
+traffic file, that has no conflicts (see detection.conflict_pairs)."""
+
+import argparse
+
+import numpy as np
+
+import airport
+import geometry
+import routing
+import traffic
+
+DELAY_STEP = 2  # Increment of the start delay between two attempts (time steps)
+MAX_DELAY = 3600 // traffic.STEP  # Maximal start delay of a flight (time steps)
+NEIGHBOURS = tuple((di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1))  # Cells around a cell
+
+
+class ReservationTable:
+    """Space-time footprints of the planned flights, with the following attributes:
+    - runways: airport.Runway list (the runways of the airport)
+    - cells: ((int, int, int) -> (int, int) list) dict (positions booked at each
+      time step in each cell of 'traffic.SEP' width)
+    - users: ((int, int) -> int) dict (number of flights using each runway at each time step)
+    - corridors: ((int, int) -> int) dict (number of flights in the corridor of each
+      runway at each time step)"""
+
+    def __init__(self, runways):
+        self.runways = list(runways)
+        self.cells = {}
+        self.users = {}
+        self.corridors = {}
+
+    def footprint(self, xy, use, runway):
+        """footprint(int array (n, 2), bool array (n,), airport.Runway) return Footprint
+        return the footprint of a flight of 'runway' whose positions at consecutive time
+        steps are 'xy', using its runway at the steps told by 'use'"""
+        corridors = [np.flatnonzero(geometry.seg_dists(xy, *r.coords) <= traffic.RWY_SEP).tolist()
+                     for r in self.runways]
+        return Footprint(xy.tolist(), (xy // traffic.SEP).tolist(), np.flatnonzero(use).tolist(),
+                         self.runways.index(runway), corridors)
+
+    def is_free(self, footprint, t0):
+        """is_free(Footprint, int) return bool
+        tells if 'footprint', starting at time step 't0', conflicts with no booked flight"""
+        sep2 = traffic.SEP ** 2
+        r = footprint.runway
+        for k in footprint.use:
+            if self.corridors.get((r, t0 + k)):
+                return False
+        for (r, steps) in enumerate(footprint.corridors):
+            for k in steps:
+                if self.users.get((r, t0 + k)):
+                    return False
+        for (k, ((x, y), (i, j))) in enumerate(zip(footprint.xy, footprint.cells)):
+            t = t0 + k
+            for (di, dj) in NEIGHBOURS:
+                for (u, v) in self.cells.get((t, i + di, j + dj), ()):
+                    if (u - x) ** 2 + (v - y) ** 2 < sep2:
+                        return False
+        return True
+
+    def book(self, footprint, t0):
+        """book(Footprint, int): books 'footprint' starting at time step 't0'"""
+        for (k, (xy, (i, j))) in enumerate(zip(footprint.xy, footprint.cells)):
+            self.cells.setdefault((t0 + k, i, j), []).append(xy)
+        for k in footprint.use:
+            key = (footprint.runway, t0 + k)
+            self.users[key] = self.users.get(key, 0) + 1
+        for (r, steps) in enumerate(footprint.corridors):
+            for k in steps:
+                self.corridors[r, t0 + k] = self.corridors.get((r, t0 + k), 0) + 1
+
+
+class Footprint:
+    """Space-time footprint of a flight starting at time step 0, with the following attributes:
+    - xy: (int, int) list (position at each time step)
+    - cells: (int, int) list (cell of each position)
+    - use: int list (time steps where the flight uses its runway)
+    - runway: int (rank of the runway of the flight)
+    - corridors: int list list (time steps where the flight is in the corridor of each runway)"""
+
+    def __init__(self, xy, cells, use, runway, corridors):
+        self.xy = xy
+        self.cells = cells
+        self.use = use
+        self.runway = runway
+        self.corridors = corridors
+
+
+def candidate_routes(table, flight, route):
+    """candidate_routes(routing.RouteTable, Flight, int32 array (n, 2)) return (int32 array, int) list
+    return the possible routes of 'flight' whose original route is 'route', with the
+    time step where each one enters (DEP) or leaves (ARR) the runway: the shortest
+    route of the table between its stand and the runway point closest to where its
+    original route meets the runway, then its original route"""
+    rwy_step = min(max(flight.rwy_t - flight.start_t, 0), len(route) - 1)
+    routes = []
+    graph = table.graph
+    points = [name for name in flight.runway.named_points if name in table.rank]
+    if flight.stand.name in graph.points and points:
+        distances = [np.hypot(*(graph.xy[graph.points[name]] - route[rwy_step])) for name in points]
+        found = table.route(flight.stand.name, points[int(np.argmin(distances))], flight.cat, flight.type)
+        if found is not None:
+            taxi = graph.sample(found[1])
+            if flight.type == traffic.Movement.ARR:
+                routes.append((np.concatenate((route[:rwy_step], taxi)), rwy_step))
+            else:
+                routes.append((np.concatenate((taxi, route[rwy_step + 1:])), len(taxi) - 1))
+    routes.append((route, rwy_step))
+    return routes
+
+
+def plan(apt, table, store, delay_step=DELAY_STEP, max_delay=MAX_DELAY):
+    """plan(airport.Airport, routing.RouteTable, traffic.TrafficStore, int, int)
+    return ((str -> array) dict, int list, Flight list)
+    plans the flights of 'store' at the airport 'apt' in beginning time order and return
+    the columns (see traffic.parse_lines) of the planned flights, their start delays
+    (time steps) and the flights that could not be planned without conflict with a start
+    delay up to 'max_delay' time steps (they are left out)"""
+    booked = ReservationTable(apt.runways)
+    rows, routes, delays, rejected = [], [], [], []
+    for flight in sorted(store, key=lambda f: (f.start_t, f.index)):
+        options = []
+        for (route, rwy_step) in candidate_routes(table, flight, flight.route):
+            if flight.type == traffic.Movement.ARR:
+                use = np.arange(len(route)) <= rwy_step
+            else:
+                use = np.arange(len(route)) >= rwy_step
+            options.append((booked.footprint(route, use, flight.runway), route, rwy_step))
+        planned = None
+        for delay in range(0, max_delay + 1, delay_step):
+            for (footprint, route, rwy_step) in options:
+                if booked.is_free(footprint, flight.start_t + delay):
+                    planned = (footprint, route, rwy_step, delay)
+                    break
+            if planned is not None:
+                break
+        if planned is None:
+            rejected.append(flight)
+            continue
+        footprint, route, rwy_step, delay = planned
+        start_t = flight.start_t + delay
+        booked.book(footprint, start_t)
+        delays.append(delay)
+        rows.append((0 if flight.type is None else flight.type.value, flight.call_sign, flight.cat.value,
+                     flight.stand.name, flight.qfu, start_t * traffic.STEP, (start_t + rwy_step) * traffic.STEP,
+                     -1 if flight.slot is None else flight.slot * traffic.STEP))
+        routes.append(route)
+
+    def column(i, dtype):
+        return np.array([row[i] for row in rows], dtype=dtype)
+
+    columns = {'type': column(0, np.int8), 'call_sign': column(1, str), 'cat': column(2, np.int8),
+               'stand': column(3, str), 'qfu': column(4, str), 'start_t': column(5, np.int64),
+               'rwy_t': column(6, np.int64), 'slot': column(7, np.int64),
+               'xy': np.concatenate(routes) if routes else np.zeros((0, 2), dtype=np.int32),
+               'lengths': np.array([len(route) for route in routes], dtype=np.int64)}
+    return columns, delays, rejected
+
+
+if __name__ == "__main__":
+    # Command line options
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--airport', default="DATA/lfpg_map.txt", help="airport description file")
+    parser.add_argument('--traffic', default="DATA/lfpg_flights.txt", help="traffic file to plan")
+    parser.add_argument('--output', required=True, help="planned traffic file to write")
+    parser.add_argument('--delay-step', type=int, default=DELAY_STEP,
+                        help="increment of the start delay between two attempts (time steps)")
+    parser.add_argument('--max-delay', type=int, default=MAX_DELAY,
+                        help="maximal start delay of a flight (time steps)")
+    parser.add_argument('--two-way', action='store_true', help="ignore the one-way taxiways")
+    args = parser.parse_args()
+
+    # Load files
+    apt = airport.from_file(args.airport)
+    route_table = routing.from_file(apt, args.airport, not args.two_way)
+    flights = traffic.from_file(apt, args.traffic)
+
+    # plan the flights and write them
+    planned, start_delays, unplanned = plan(apt, route_table, flights, args.delay_step, args.max_delay)
+    with open(args.output, 'w') as file:
+        file.writelines(traffic.to_lines(planned))
+    print(len(start_delays), "flights planned with a mean delay of",
+          "{:.1f} s,".format(np.mean(start_delays) * traffic.STEP if start_delays else 0.),
+          len(unplanned), "not planned", ' '.join(f.call_sign for f in unplanned))
@@ -1,13 +1,16 @@
 """Handling graphical aircraft representation and their motions.
 
-This modules allows the representation of aircraft (AircraftItem)
-and the management of their motions (AircraftItemsMotionManager)"""
-from PyQt5.QtCore import pyqtSlot
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPen, QBrush, QColor
-from PyQt5.QtWidgets import QGraphicsEllipseItem, QGraphicsRectItem, QGraphicsItemGroup
+This modules allows the representation of all the aircraft in a single
+graphics item (AircraftLayer), painted at once from the positions of the
+current snapshot, and the management of their motions
+(AircraftItemsMotionManager)"""
+import numpy as np
+from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtGui import QPen, QBrush, QColor, QPainterPath
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
 
 import airport
+import simulation
 import traffic
 import radarview
 
@@ -26,9 +29,13 @@ PEN_WIDTH = 3
 DEP_PEN = QPen(QColor(DEP_COLOR), PEN_WIDTH)
 ARR_PEN = QPen(QColor(ARR_COLOR), PEN_WIDTH)
 CONF_PEN = QPen(QColor(CONF_COLOR), PEN_WIDTH)
-SEL_PEN = QPen(QColor(SEL_COLOR), 40)
+SEL_WIDTH = 40
+SEL_PEN = QPen(QColor(SEL_COLOR), SEL_WIDTH)
 NO_PEN = QPen(Qt.NoPen)
 
+# level of detail (pixels per meter) above which trails and tooltips are shown
+DETAILS_LOD = 0.2
+
 
 class AircraftItemsMotionManager:
     """Collection of aircraft items and their motion management"""
@@ -36,116 +43,143 @@ class AircraftItemsMotionManager:
     def __init__(self, radar):
         # reference to the radar view
         self.radarView = radar
-        # list of the current flights
-        self.current_flights = []
-        # dictionary of the corresponding aircraft items in the scene
-        self.aircraft_items_dict = {}
-
-        # populate flight list and aircraft items dictionary then create and update the corresponding aircraft items
-        self.update_aircraft_items()
-
-    def update_aircraft_items(self):
-        """ updates Plots views """
-        new_flights = self.radarView.simulation.current_flights
-        # add new aircraft items for flights who joined
-        for f in set(new_flights) - set(self.current_flights):
-            item = AircraftItem(self.radarView.simulation, f, self)  # create an item
-            self.radarView.scene.addItem(item)  # add it to scene
-            self.aircraft_items_dict[f] = item  # add it to item dict
-        # remove aircraft items for flights who left
-        for f in set(self.current_flights) - set(new_flights):
-            item = self.aircraft_items_dict.pop(f)  # get item from flight in the dictionary (and remove it)
-            self.radarView.scene.removeItem(item)   # remove it also from scene
-        # refresh current flights list
-        self.current_flights = new_flights
-        # get conflicting flights
-        conf = self.radarView.simulation.conflicts
-        # update positions of the current aircraft items
-        for aircraft_number in self.aircraft_items_dict:
-            aircraft = self.aircraft_items_dict[aircraft_number]
-            aircraft.update_position(aircraft.flight in conf)
-        # tell everyone who is listening that there is a flight list update
-        self.radarView.ask_flight_list_update(self.current_flights)
+        # the single item painting all the aircraft
+        self.layer = AircraftLayer(self)
+        self.radarView.scene.addItem(self.layer)
+
+        # populate flight list then update the aircraft layer
+        self.update_aircraft_items(radar.snapshot, resync=True)
+
+    def update_aircraft_items(self, snapshot, resync=False):
+        """ updates Plots views from 'snapshot' (simulation.Snapshot), which follows
+        the previous one unless 'resync' is set """
+        # repaint all the aircraft at once
+        self.layer.set_snapshot(snapshot)
+        # tell everyone who is listening which flights began or stopped moving
+        if resync:
+            delta = simulation.FlightsDelta(snapshot.flights, (), True)
+        else:
+            delta = simulation.FlightsDelta(snapshot.entered, snapshot.left, False)
+        self.radarView.ask_flight_list_update(delta)
 
     def toggle_plots_highlighting(self, flight):
         """highlight flight item and cancel highlighting on the potentially previously clicked item"""
-        for item in self.aircraft_items_dict.values():
-            item.toggle_highlight(flight)
+        self.layer.toggle_highlight(flight)
 
 
-class AircraftItem(QGraphicsItemGroup):
-    """The view of an aircraft in the GraphicsScene"""
+class AircraftLayer(QGraphicsItem):
+    """The view of all the aircraft in the GraphicsScene, with the following attributes:
+    - snapshot: simulation.Snapshot (the displayed state)
+    - radius: float array (n,) (radius of the head of each aircraft)
+    - selected: None | Flight (the highlighted flight)"""
 
-    def __init__(self, simu, f, motion_manager):
-        """AircraftItem constructor, creates the ellipse and adds to the scene"""
+    def __init__(self, motion_manager):
         super().__init__(None)
         self.setZValue(radarview.PLOT_Z_VALUE)
+        self.setAcceptHoverEvents(True)
 
         # instance variables
         self.motion_manager = motion_manager
-        self.flight = f
-        self.simulation = simu
-
-        # list to store the comet elements as ellipses
-        self.comete = []
+        self.snapshot = None
+        self.radius = np.zeros(0)
+        self.selected = None
+        self.bounds = QRectF()
+        self.heads_path = None
 
-        # create the tooltip
-        tooltip = f.type.name + ' ' + f.call_sign + ' ' + f.qfu
+        # connect to ask_inspection_signal in order to toggle_highlight the inspected flight
+        self.motion_manager.radarView.ask_inspection_signal.connect(self.toggle_highlight)
 
-        time = self.simulation.t
-        for (idx, ti) in enumerate(range(time - 4, time + 1)):
-            if idx < 4:
-                item = QGraphicsRectItem()
-                item.setPen(DEP_PEN if self.flight.type == traffic.Movement.DEP else ARR_PEN)
+    def set_snapshot(self, snapshot):
+        """displays the aircraft of 'snapshot' (simulation.Snapshot)"""
+        self.snapshot = snapshot
+        heavy = np.array([f.cat == airport.WakeVortexCategory.HEAVY for f in snapshot.flights], dtype=bool)
+        width = np.where(heavy, 1.5 * traffic.SEP, traffic.SEP)
+        self.radius = width / 1.2
+        self.heads_path = None
+        self.prepareGeometryChange()
+        if len(snapshot.flights):
+            margin = self.radius.max() + SEL_WIDTH / 2
+            (x1, y1), (x2, y2) = snapshot.comets.min(axis=(0, 1)), snapshot.comets.max(axis=(0, 1))
+            self.bounds = QRectF(x1 - margin, y1 - margin, x2 - x1 + 2 * margin, y2 - y1 + 2 * margin)
+        else:
+            self.bounds = QRectF()
+        self.update()
+
+    def boundingRect(self):
+        return self.bounds
+
+    def shape(self):
+        """Overrides method in QGraphicsItem so that only the aircraft heads are hit"""
+        if self.heads_path is None:
+            self.heads_path = QPainterPath()
+            for ((x, y), r) in zip(self.snapshot.comets[:, -1].tolist(), self.radius.tolist()):
+                self.heads_path.addEllipse(QPointF(x, y), r, r)
+        return self.heads_path
+
+    def paint(self, painter, option, widget=None):
+        """paints all the aircraft, with their trails if the view is zoomed in enough"""
+        if not self.snapshot.flights:
+            return
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        comets = self.snapshot.comets.tolist()
+        departures = [f.type == traffic.Movement.DEP for f in self.snapshot.flights]
+        radius = self.radius.tolist()
+        length = self.snapshot.comets.shape[1]
+        if lod >= DETAILS_LOD:
+            # trails: the previous positions, growing towards the head (the oldest one is not drawn)
+            painter.setBrush(Qt.NoBrush)
+            for (pen, is_dep) in ((DEP_PEN, True), (ARR_PEN, False)):
+                rects = []
+                for (comet, r, dep) in zip(comets, radius, departures):
+                    if dep == is_dep:
+                        for idx in range(1, length - 1):
+                            (x, y), wi = comet[idx], r * 1.2 / (2 - 0.8 * idx / (length - 1))
+                            rects.append(QRectF(x - wi, y - wi, 2 * wi, 2 * wi))
+                painter.setPen(pen)
+                painter.drawRects(rects)
+        # heads
+        painter.setPen(NO_PEN)
+        for (f, comet, r, dep) in zip(self.snapshot.flights, comets, radius, departures):
+            if f in self.snapshot.conflicts:
+                painter.setBrush(CONF_BRUSH)
             else:
-                item = QGraphicsEllipseItem()
-                item.setBrush(DEP_BRUSH if self.flight.type == traffic.Movement.DEP else ARR_BRUSH)
-                item.setToolTip(tooltip)
-
-            self.comete.append(item)
-            self.addToGroup(item)
-            position = self.flight.get_position(ti)
-            item.setPos(position.x, position.y)
-
-        # compute the width of each element
-        self.update_size()
-        # connect to ask_inspection_signal in order to toggle_highlight this item
-        self.motion_manager.radarView.ask_inspection_signal.connect(self.toggle_highlight)
+                painter.setBrush(DEP_BRUSH if dep else ARR_BRUSH)
+            painter.drawEllipse(QPointF(*comet[-1]), r, r)
+        if self.selected in self.snapshot.flights:
+            k = self.snapshot.flights.index(self.selected)
+            painter.setPen(SEL_PEN)
+            painter.setBrush(Qt.NoBrush)
+            painter.drawEllipse(QPointF(*comets[k][-1]), radius[k], radius[k])
+
+    def flight_at(self, pos):
+        """flight_at(QPointF) return None | Flight
+        return the flight whose head is under the scene position 'pos' (the nearest one)"""
+        if not self.snapshot.flights:
+            return None
+        d2 = ((self.snapshot.comets[:, -1] - (pos.x(), pos.y())) ** 2).sum(axis=1)
+        k = int(np.argmin(d2 - self.radius ** 2))
+        return self.snapshot.flights[k] if d2[k] <= self.radius[k] ** 2 else None
 
     def mousePressEvent(self, event):
         """Overrides method in QGraphicsItem for interaction on the scene"""
+        flight = self.flight_at(event.pos())
+        if flight is None:
+            event.ignore()
+            return
         event.accept()
-        # ask inspection of this flight
-        self.motion_manager.radarView.ask_inspection(self.flight)
-        # highlight this flight and cancel highlighting on the potentially previously clicked flight
-        # not necessary because each plot now listens the ask_inspection_signal and highlight itself accordingly
-        # self.motion_manager.toggle_plots_highlighting(self.flight)
-
-    def update_position(self, is_conflict):
-        """moves the plot in the scene"""
-
-        time = self.simulation.t
-        for (idx, ti) in enumerate(range(time - 4, time + 1)):
-            item = self.comete[idx]
-
-            if idx == 4:
-                if is_conflict:
-                    item.setBrush(CONF_BRUSH)
-                else:
-                    item.setBrush(DEP_BRUSH if self.flight.type == traffic.Movement.DEP else ARR_BRUSH)
-
-            position = self.flight.get_position(ti)
-            item.setPos(position.x, position.y)
-
-    def update_size(self):
-        """computes and updates the size of this item"""
-        width = 1.5 * traffic.SEP if self.flight.cat == airport.WakeVortexCategory.HEAVY else traffic.SEP
-
-        for idx in range(1, 5):
-            item = self.comete[idx]
-            wi = width * 1 / (2 - idx / 5)
-            item.setRect(-wi, -wi, wi * 2, wi * 2)
+        # ask inspection of this flight (the layer listens the ask_inspection_signal to highlight it)
+        self.motion_manager.radarView.ask_inspection(flight)
+
+    def hoverMoveEvent(self, event):
+        """Overrides method in QGraphicsItem to show the tooltip of the hovered aircraft"""
+        view = event.widget().parent()
+        flight = self.flight_at(event.pos())
+        if flight is None or QStyleOptionGraphicsItem.levelOfDetailFromTransform(view.transform()) < DETAILS_LOD:
+            self.setToolTip('')
+        else:
+            self.setToolTip(flight.type.name + ' ' + flight.call_sign + ' ' + flight.qfu)
 
     def toggle_highlight(self, flight):
-        """ this function toggles highlighting of the plot """
-        self.comete[4].setPen(SEL_PEN if flight == self.flight else NO_PEN)
+        """ this function toggles highlighting of the inspected flight """
+        self.selected = flight
+        self.update()
@@ -4,11 +4,14 @@ This module allows the visualization of an airport and its flights
 on a scalable graphics view"""
 
 import math
+import traceback
 
+import numpy as np
 from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtGui import QPen, QBrush, QColor
 
 import airport
+import simulation
 import traffic
 import radarmotion
 
@@ -51,22 +54,201 @@ class PanZoomView(QtWidgets.QGraphicsView):
         super().scale(factor, factor)
 
 
+def segment_distances(segments, x, y):
+    """segment_distances(float array, float, float) return float array
+    return the distances between the point (x, y) and the (n, 4) 'segments' (x1, y1, x2, y2)"""
+    p1, d = segments[:, :2], segments[:, 2:] - segments[:, :2]
+    length2 = (d ** 2).sum(axis=1)
+    u = ((x - p1[:, 0]) * d[:, 0] + (y - p1[:, 1]) * d[:, 1]) / np.where(length2 > 0, length2, 1)
+    closest = p1 + d * np.clip(u, 0, 1)[:, None]
+    return np.hypot(closest[:, 0] - x, closest[:, 1] - y)
+
+
+class AirportTile(QtWidgets.QGraphicsItem):
+    """A part of the static view of the airport, with one merged path per
+    category of elements, cached as a pixmap by Qt, with the following attributes:
+    - taxiways, runways, stands, points: QPainterPath (the merged elements)
+    - segments: (float array, str list) tuple (segments (n, 4) of the taxiways
+      and then of the runways, with the tooltip of each segment)
+    - named_points: float array (n, 2) (positions of the named points)
+    - point_tips: str list (tooltips of the named points)
+    - bounds: QRectF (the area covered by the elements of the tile)"""
+
+    def __init__(self, layer):
+        super().__init__(layer)
+        self.setAcceptHoverEvents(True)
+        # the tile is only rendered again when the zoom changes, not when the view pans
+        # or when the aircraft move over it
+        self.setCacheMode(self.DeviceCoordinateCache)
+        self.taxiways, self.runways = QtGui.QPainterPath(), QtGui.QPainterPath()
+        self.stands, self.points = QtGui.QPainterPath(), QtGui.QPainterPath()
+        # overlapping points must not cancel each other
+        self.stands.setFillRule(QtCore.Qt.WindingFill)
+        self.points.setFillRule(QtCore.Qt.WindingFill)
+        self.segments = ([], [])
+        self.named_points = []
+        self.point_tips = []
+        self.bounds = QtCore.QRectF()
+
+    def add_line(self, path, segments, coords, tip, width):
+        """adds the polyline 'coords' (Point tuple) to 'path' and its segments to 'segments'
+        (one of the two lists of self.segments), with the tooltip 'tip'"""
+        path.moveTo(coords[0].x, coords[0].y)
+        for xy in coords[1:]:
+            path.lineTo(xy.x, xy.y)
+        segments.extend(((p1.x, p1.y, p2.x, p2.y), tip) for (p1, p2) in zip(coords[:-1], coords[1:]))
+        self.bounds |= path.boundingRect().adjusted(-width / 2, -width / 2, width / 2, width / 2)
+
+    def add_point(self, bounds, point, tip):
+        """adds the named 'point' (covering 'bounds') with the tooltip 'tip'"""
+        self.named_points.append((point.x, point.y))
+        self.point_tips.append(tip)
+        self.bounds |= bounds
+
+    def finish(self):
+        """converts the lists of elements to arrays once the tile is complete"""
+        self.segments = tuple((np.array([s for (s, _) in segments], dtype=float).reshape(-1, 4),
+                               [tip for (_, tip) in segments])
+                              for segments in self.segments)
+        self.named_points = np.array(self.named_points, dtype=float).reshape(-1, 2)
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        """paints the elements of the tile, one category of elements at a time"""
+        pen = QPen(QtGui.QColor(APT_COLOR), airport.TAXIWAY_WIDTH)
+        pen.setCapStyle(QtCore.Qt.RoundCap)
+        painter.setPen(pen)
+        painter.setBrush(QtCore.Qt.NoBrush)
+        painter.drawPath(self.taxiways)
+        painter.setPen(QPen(QtGui.QColor(APT_COLOR), airport.RUNWAY_WIDTH))
+        painter.drawPath(self.runways)
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(STAND_BRUSH)
+        painter.drawPath(self.stands)
+        painter.setBrush(POINT_BRUSH)
+        painter.drawPath(self.points)
+
+    def hoverMoveEvent(self, event):
+        """Overrides method in QGraphicsItem to show the tooltip of the hovered element"""
+        self.setToolTip(self.parentItem().tooltip_at(event.scenePos()))
+
+
+class AirportLayer(QtWidgets.QGraphicsItem):
+    """The static view of the airport in the GraphicsScene, split in GRID x GRID
+    tiles so that each one is cached and drawn independently, with the following attributes:
+    - tiles: AirportTile list (the non empty tiles)
+    - point_radius: float (half width of the named points)
+    - bounds: QRectF (the area covered by the airport)"""
+
+    GRID = 8  # Number of tiles along each axis
+
+    def __init__(self, apt):
+        super().__init__(None)
+        self.setZValue(AIRPORT_Z_VALUE)
+        self.setFlag(self.ItemHasNoContents)
+
+        # each element goes to the tile containing the center of its first segment
+        xy = airport.points_to_array(apt.points)
+        for line in apt.taxiways + apt.runways:
+            xy = np.concatenate((xy, airport.points_to_array(line.coords)))
+        (x_min, y_min), (x_max, y_max) = xy.min(axis=0), xy.max(axis=0)
+        grid = {}
+
+        def tile(*points):
+            x, y = sum(p.x for p in points) / len(points), sum(p.y for p in points) / len(points)
+            i = min(int((x - x_min) * self.GRID / max(x_max - x_min, 1)), self.GRID - 1)
+            j = min(int((y - y_min) * self.GRID / max(y_max - y_min, 1)), self.GRID - 1)
+            if (i, j) not in grid:
+                grid[i, j] = AirportTile(self)
+            return grid[i, j]
+
+        # Taxiways and runways
+        for taxiway in apt.taxiways:
+            t = tile(*taxiway.coords[:2])
+            t.add_line(t.taxiways, t.segments[0], taxiway.coords, 'Taxiway ' + taxiway.taxi_name,
+                       airport.TAXIWAY_WIDTH)
+        for runway in apt.runways:
+            t = tile(*runway.coords[:2])
+            t.add_line(t.runways, t.segments[1], runway.coords, 'Runway ' + runway.name, airport.RUNWAY_WIDTH)
+
+        # Named points
+        width = 0.7 * traffic.SEP
+        dw = width / 2.
+        for point in apt.points:
+            bounds = QtCore.QRectF(point.x - dw, point.y - dw, width, width)
+            t = tile(point)
+            if point.type == airport.PointType.STAND:
+                t.stands.addEllipse(bounds)
+                point_type_description = "Stand"
+            else:
+                t.points.addRect(bounds)
+                if point.type == airport.PointType.RUNWAY_POINT:
+                    point_type_description = "Runway point"
+                else:
+                    point_type_description = "Deicing point"
+            t.add_point(bounds, point, point_type_description + ' ' + point.name)
+        self.point_radius = dw
+
+        self.tiles = list(grid.values())
+        self.bounds = QtCore.QRectF()
+        for t in self.tiles:
+            t.finish()
+            self.bounds |= t.bounds
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        """nothing to paint: the tiles paint the airport"""
+
+    def tooltip_at(self, pos):
+        """tooltip_at(QPointF) return str
+        return the description of the element under the scene position 'pos' (the
+        named points being above the runways, themselves above the taxiways),
+        only looking at the tiles covering this position"""
+        x, y = pos.x(), pos.y()
+        tiles = [t for t in self.tiles if t.bounds.contains(pos)]
+        for t in tiles:
+            if len(t.named_points):
+                d = np.abs(t.named_points - (x, y)).max(axis=1)
+                k = int(np.argmin(d))
+                if d[k] <= self.point_radius:
+                    return t.point_tips[k]
+        for (kind, width) in ((1, airport.RUNWAY_WIDTH), (0, airport.TAXIWAY_WIDTH)):
+            for t in tiles:
+                segments, tips = t.segments[kind]
+                if len(segments):
+                    d = segment_distances(segments, x, y)
+                    k = int(np.argmin(d))
+                    if d[k] <= width / 2:
+                        return tips[k]
+        return ''
+
+
 class RadarView(QtWidgets.QWidget):
     """An interactive view of an airport and its flights,
     with the following attributes:
     - scene: QtWidgets.QGraphicsScene (the graphic scene)
     - view: QtWidgets.QGraphicsView (the view of the scene)
-    - moving_aircraft: radarmotion.AircraftItemsMotionManager  """
+    - moving_aircraft: radarmotion.AircraftItemsMotionManager
+    - snapshot: simulation.Snapshot (the displayed state of the simulation)
+    - stepper: None | simulation.Stepper (the thread computing the next
+      snapshots during the replay, which owns the simulation until it is stopped)"""
 
     # custom signal to ask inspection
     ask_inspection_signal = QtCore.pyqtSignal(traffic.Flight)
     # custom signal to tell inspector that flight list has changed
-    flight_list_changed_signal = QtCore.pyqtSignal(list)
+    # (with the simulation.FlightsDelta since the previous signal)
+    flight_list_changed_signal = QtCore.pyqtSignal(object)
 
     def __init__(self, simu):
         super().__init__()
         self.simulation = simu
         self.time_increment = 1
+        self.snapshot = simu.snapshot()
+        self.stepper = None
 
         # Settings
         self.setWindowTitle('Airport Sim at ' + self.simulation.airport.name)
@@ -152,10 +334,8 @@ class RadarView(QtWidgets.QWidget):
 
         # slot
         def change_traffic_sep(val):
-            traffic.SEP = val
+            self.set_separation(val)
             sliderlbl.setText(str(val))
-            for item in self.moving_aircraft.aircraft_items_dict.values():
-                item.update_size()
 
         # connect signal to slot
         sld.valueChanged.connect(change_traffic_sep)
@@ -168,89 +348,94 @@ class RadarView(QtWidgets.QWidget):
         return toolbar
 
     def add_airport_items(self):
-        """ Adds the airport (as a group) to the QGraphicsScene, drawn by the view"""
-
-        airport_group = QtWidgets.QGraphicsItemGroup()
-        self.scene.addItem(airport_group)
-        airport_group.setZValue(AIRPORT_Z_VALUE)
-
-        apt = self.simulation.airport
-
-        # Taxiways
-        pen = QPen(QtGui.QColor(APT_COLOR), airport.TAXIWAY_WIDTH)
-        pen.setCapStyle(QtCore.Qt.RoundCap)
-        for taxiway in apt.taxiways:
-            path = QtGui.QPainterPath()
-            path.moveTo(taxiway.coords[0].x, taxiway.coords[0].y)
-            for xy in taxiway.coords[1:]:
-                path.lineTo(xy.x, xy.y)
-            item = QtWidgets.QGraphicsPathItem(path, airport_group)
-            item.setPen(pen)
-            item.setToolTip('Taxiway ' + taxiway.taxi_name)
-
-        # Runways
-        pen = QPen(QtGui.QColor(APT_COLOR), airport.RUNWAY_WIDTH)
-        for runway in apt.runways:
-            (p1, p2) = runway.coords
-            item = QtWidgets.QGraphicsLineItem(p1.x, p1.y, p2.x, p2.y, airport_group)
-            item.setPen(pen)
-            item.setToolTip('Runway ' + runway.name)
-
-        # Named points
-        pen = QPen(QtCore.Qt.transparent)
-        width = 0.7 * traffic.SEP
-        dw = width / 2.
-        for point in apt.points:
-            bounds = QtCore.QRectF(point.x - dw, point.y - dw, width, width)
-            if point.type == airport.PointType.STAND:
-                item = QtWidgets.QGraphicsEllipseItem(bounds, airport_group)
-                item.setBrush(STAND_BRUSH)
-                point_type_description = "Stand"
-            else:
-                item = QtWidgets.QGraphicsRectItem(bounds, airport_group)
-                item.setBrush(POINT_BRUSH)
-                if point.type == airport.PointType.RUNWAY_POINT:
-                    point_type_description = "Runway point"
-                else:
-                    point_type_description = "Deicing point"
-            item.setPen(pen)
-            item.setToolTip(point_type_description + ' ' + point.name)
+        """ Adds the airport (as a single layer) to the QGraphicsScene, drawn by the view"""
+        self.scene.addItem(AirportLayer(self.simulation.airport))
 
     def fit_scene_in_view(self):
         self.view.fitInView(self.view.sceneRect(), QtCore.Qt.KeepAspectRatio)
 
-    def update_traffic(self):
-        self.moving_aircraft.update_aircraft_items()
-        self.time_entry.setText(traffic.hms(self.simulation.t))
+    def update_traffic(self, snapshot, seek=False):
+        """displays the state of the simulation given by 'snapshot', the listeners
+        of the flight list being fully resynchronised after a 'seek' or if
+        'snapshot' does not follow the displayed one"""
+        resync = seek or snapshot.since != self.snapshot.t
+        self.snapshot = snapshot
+        self.moving_aircraft.update_aircraft_items(snapshot, resync)
+        self.time_entry.setText(traffic.hms(snapshot.t))
+
+    def start_stepper(self):
+        """starts computing the next snapshots in the background"""
+        self.stepper = simulation.Stepper(self.simulation, self.time_increment)
+        self.stepper.start()
+
+    def stop_stepper(self):
+        """stops computing the next snapshots and brings the simulation back
+        to the displayed time step (the stepper might be ahead of it)"""
+        if self.stepper is not None:
+            self.stepper.stop()
+            self.stepper = None
+            self.simulation.set_time(self.snapshot.t)
+
+    def set_separation(self, sep):
+        """sets the minimal separation (traffic.SEP) to 'sep' and displays the conflicts
+        of the current time step detected again with it (the stepper, that reads it,
+        is stopped meanwhile and its snapshots computed with the previous one dropped)"""
+        playing = self.stepper is not None
+        self.stop_stepper()
+        traffic.SEP = sep
+        self.simulation.set_time(self.snapshot.t)
+        self.update_traffic(self.simulation.snapshot())
+        if playing:
+            self.start_stepper()
 
     @QtCore.pyqtSlot()
     def change_time(self):
         """slot triggered when a new time is input in the text field"""
+        playing = self.stepper is not None
+        self.stop_stepper()
         self.simulation.set_time(traffic.time_step(self.time_entry.text()))
         self.time_entry.clearFocus()
-        self.update_traffic()
+        self.update_traffic(self.simulation.snapshot(), seek=True)
+        if playing:
+            self.start_stepper()
 
     @QtCore.pyqtSlot()
     def advance(self):
-        """this slot computes the new time at each time out"""
-        self.simulation.increment_time(self.time_increment)
-        self.update_traffic()
+        """this slot displays the next snapshot at each time out, if it is ready
+        (the replay is stopped and the error reported if the stepper failed)"""
+        try:
+            snapshot = self.stepper.next_snapshot() if self.stepper is not None else None
+        except Exception as error:
+            # the stepper thread is over, and the simulation is left where it failed
+            self.timer.stop()
+            self.stepper = None
+            traceback.print_exception(type(error), error, error.__traceback__)
+            QtWidgets.QMessageBox.critical(self, "Simulation error",
+                                           "The replay stopped at {}: {}".format(traffic.hms(self.snapshot.t), error))
+            return
+        if snapshot is not None:
+            self.update_traffic(snapshot)
 
     @QtCore.pyqtSlot(int)
     def set_time_increment(self, dt):
         """this slot updates the speed of the replay"""
         self.time_increment = dt
+        if self.stepper is not None:
+            self.stop_stepper()
+            self.start_stepper()
 
     @QtCore.pyqtSlot()
     def playpause(self):
         """this slot toggles the replay using the timer as model"""
         if self.timer.isActive():
             self.timer.stop()
+            self.stop_stepper()
         else:
+            self.start_stepper()
             self.timer.start(ANIMATION_DELAY)
 
     def ask_inspection(self, flight):
         self.ask_inspection_signal.emit(flight)
 
-    def ask_flight_list_update(self, flight_list):
-        self.flight_list_changed_signal.emit(flight_list)
+    def ask_flight_list_update(self, delta):
+        self.flight_list_changed_signal.emit(delta)
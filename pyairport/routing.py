@@ -0,0 +1,269 @@
+"""Taxiway routing.
+
+This module builds the directed graph of the taxiways of an airport (the
+taxiways being cut at each crossing, with their one-way direction and
+their wake vortex category limit), computes time-weighted shortest paths
+on it, and precomputes the shortest paths between every stand and every
+runway point, saved in a binary file next to the airport file, so that
+the route of a flight is then obtained by a simple lookup."""
+
+import heapq
+import math
+
+import numpy as np
+
+import airport
+import datacache
+import traffic
+
+SUFFIX = '.routes.npz'  # Suffix of the route table file added to the airport file name
+TWO_WAY_SUFFIX = '.two_way.routes.npz'  # Suffix of the route table ignoring one-way taxiways
+VERSION = 1  # Version of the route computation, to be increased when it changes
+SNAP = 30  # Maximal distance (meters) between a named point and its taxiway node
+DEP, ARR = 0, 1  # Directions of the routes in the table (stand to runway point, and back)
+
+
+class Graph:
+    """Directed graph of the taxiways of an airport, with the following attributes:
+    - xy: int32 array (n, 2) (positions of the nodes)
+    - nodes: ((int, int) -> int) dict (node at each position)
+    - points: (str -> int) dict (node of each named point)
+    - src, dst: int array (m,) (first and last nodes of each edge)
+    - time: float array (m,) (taxi time along each edge, in seconds)
+    - speed: float array (m,) (speed along each edge, in m/s)
+    - cat: int8 array (m,) (largest wake vortex category allowed on each edge)
+    - coords: int32 array list (points of each edge, from 'src' to 'dst')
+    - out, into: int list list (edges leaving and entering each node)
+    One-way taxiways only give an edge from their first point to their last one
+    (those with a negative speed are the pushback lanes, followed backwards)."""
+
+    def __init__(self, apt, one_way=True):
+        # the nodes are the ends of the taxiways and the named points
+        ends = {(line.coords[i].x, line.coords[i].y) for line in apt.taxiways for i in (0, -1)}
+        vertices = np.array(sorted({(p.x, p.y) for line in apt.taxiways for p in line.coords}),
+                            dtype=np.int64).reshape(-1, 2)
+        self.points = {}
+        for point in apt.points:
+            xy = (point.x, point.y)
+            if xy not in ends and len(vertices):
+                d = np.hypot(*(vertices - xy).T)
+                k = int(np.argmin(d))
+                if d[k] > SNAP:
+                    continue
+                xy = tuple(vertices[k].tolist())
+            ends.add(xy)
+            self.points[point.name] = xy
+        self.nodes = {xy: i for (i, xy) in enumerate(sorted(ends))}
+        self.xy = np.array(sorted(ends), dtype=np.int32).reshape(-1, 2)
+        self.points = {name: self.nodes[xy] for (name, xy) in self.points.items()}
+
+        # each taxiway is cut at the nodes it goes through
+        edges = []
+        for taxiway in apt.taxiways:
+            xys = [(p.x, p.y) for p in taxiway.coords]
+            cuts = [i for (i, xy) in enumerate(xys) if xy in self.nodes]
+            speed = abs(taxiway.speed)
+            for (i, j) in zip(cuts[:-1], cuts[1:]):
+                coords = np.array(xys[i:j + 1], dtype=np.int32)
+                length = float(np.hypot(*np.diff(coords, axis=0).T).sum())
+                if length == 0 or speed == 0:
+                    continue
+                forward = (self.nodes[xys[i]], self.nodes[xys[j]], coords)
+                backward = (self.nodes[xys[j]], self.nodes[xys[i]], coords[::-1])
+                directions = (forward,) if one_way and taxiway.one_way else (forward, backward)
+                for (src, dst, xy) in directions:
+                    edges.append((src, dst, length / speed, speed, taxiway.cat.value, xy))
+        self.src = np.array([e[0] for e in edges], dtype=np.int64)
+        self.dst = np.array([e[1] for e in edges], dtype=np.int64)
+        self.time = np.array([e[2] for e in edges], dtype=float)
+        self.speed = np.array([e[3] for e in edges], dtype=float)
+        self.cat = np.array([e[4] for e in edges], dtype=np.int8)
+        self.coords = [e[5] for e in edges]
+        self.out = [[] for _ in range(len(self.xy))]
+        self.into = [[] for _ in range(len(self.xy))]
+        for (k, (src, dst)) in enumerate(zip(self.src.tolist(), self.dst.tolist())):
+            self.out[src].append(k)
+            self.into[dst].append(k)
+
+    def __repr__(self):
+        return "<routing.Graph {0} nodes, {1} edges>".format(len(self.xy), len(self.src))
+
+    def allowed(self, cat):
+        """allowed(airport.WakeVortexCategory) return bool array (m,)
+        return whether each edge can be used by an aircraft of category 'cat'"""
+        return self.cat >= cat.value
+
+    def tree(self, root, cat, reverse=False):
+        """tree(int, airport.WakeVortexCategory, bool) return (float array (n,), int array (n,))
+        return the shortest taxi times from node 'root' to every node (or from every
+        node to 'root' if 'reverse') for an aircraft of category 'cat' (inf if
+        unreachable), and the last edge of the path to each node (or the first edge of
+        the path from each node if 'reverse'), -1 for 'root' or unreachable nodes"""
+        allowed = self.allowed(cat).tolist()
+        time, links = self.time.tolist(), self.into if reverse else self.out
+        ends = (self.src if reverse else self.dst).tolist()
+        best = [math.inf] * len(self.xy)
+        edge = [-1] * len(self.xy)
+        best[root] = 0.
+        heap = [(0., root)]
+        while heap:
+            t, u = heapq.heappop(heap)
+            if t > best[u]:
+                continue
+            for k in links[u]:
+                v = ends[k]
+                if allowed[k] and t + time[k] < best[v]:
+                    best[v], edge[v] = t + time[k], k
+                    heapq.heappush(heap, (best[v], v))
+        return np.array(best), np.array(edge, dtype=np.int64)
+
+    def astar(self, source, target, cat, closed=()):
+        """astar(int, int, airport.WakeVortexCategory, int set) return None | (float, int list)
+        return the shortest taxi time from node 'source' to node 'target' for an aircraft
+        of category 'cat' without using the 'closed' edges, and the edges of the path, or
+        None if there is none (A* search guided by the straight line distance at the
+        highest speed)"""
+        allowed = self.allowed(cat).tolist()
+        time, dst = self.time.tolist(), self.dst.tolist()
+        speed = float(self.speed.max()) if len(self.speed) else 1.
+        xs, ys = self.xy[:, 0].tolist(), self.xy[:, 1].tolist()
+
+        def estimate(u):
+            return math.hypot(xs[target] - xs[u], ys[target] - ys[u]) / speed
+
+        best, edge = {source: 0.}, {source: -1}
+        heap = [(estimate(source), 0., source)]
+        while heap:
+            _, t, u = heapq.heappop(heap)
+            if u == target:
+                path = []
+                while edge[u] >= 0:
+                    path.append(edge[u])
+                    u = int(self.src[edge[u]])
+                return t, path[::-1]
+            if t > best[u]:
+                continue
+            for k in self.out[u]:
+                v = dst[k]
+                if allowed[k] and k not in closed and t + time[k] < best.get(v, math.inf):
+                    best[v], edge[v] = t + time[k], k
+                    heapq.heappush(heap, (t + time[k] + estimate(v), t + time[k], v))
+        return None
+
+    def polyline(self, edges):
+        """polyline(int list) return int32 array (k, 2)
+        return the points of the path made of 'edges'"""
+        if not edges:
+            return np.zeros((0, 2), dtype=np.int32)
+        return np.concatenate([self.coords[edges[0]][:1]] + [self.coords[k][1:] for k in edges])
+
+    def sample(self, edges, step=traffic.STEP):
+        """sample(int list, int) return int32 array (k, 2)
+        return the positions every 'step' seconds of an aircraft following the path
+        made of 'edges' at the speed of each edge (the last one being the end of the path)"""
+        if not edges:
+            return np.zeros((0, 2), dtype=np.int32)
+        xy = self.polyline(edges).astype(float)
+        lengths = [np.hypot(*np.diff(self.coords[k], axis=0).T) for k in edges]
+        times = np.concatenate([[0.]] + [d / self.speed[k] for (k, d) in zip(edges, lengths)]).cumsum()
+        t = np.append(np.arange(0., times[-1], step), times[-1])
+        return np.stack((np.interp(t, times, xy[:, 0]), np.interp(t, times, xy[:, 1])),
+                        axis=1).round().astype(np.int32)
+
+
+class RouteTable:
+    """Shortest routes between the stands and the runway points of an airport,
+    with the following attributes:
+    - graph: Graph (the taxiway graph)
+    - stands: str list (names of the stands)
+    - runway_points: str list (names of the runway points)
+    - time: float32 array (3, 2, r, n) (shortest taxi time, for each wake vortex
+      category and direction DEP | ARR, between each runway point and each node)
+    - edge: int32 array (3, 2, r, n) (for DEP, first edge of the path from each node
+      to each runway point, for ARR, last edge of the path from each runway point
+      to each node, -1 if there is none)"""
+
+    def __init__(self, graph, stands, runway_points, time, edge):
+        self.graph = graph
+        self.stands = stands
+        self.runway_points = runway_points
+        self.rank = {name: r for (r, name) in enumerate(runway_points)}
+        self.time = time
+        self.edge = edge
+
+    def __repr__(self):
+        return "<routing.RouteTable {0} stands x {1} runway points>".format(len(self.stands),
+                                                                            len(self.runway_points))
+
+    def times(self, cat, movement):
+        """times(airport.WakeVortexCategory, traffic.Movement) return float32 array (s, r)
+        return the shortest taxi times between each stand and each runway point"""
+        nodes = [self.graph.points[name] for name in self.stands]
+        return self.time[cat.value - 1, direction(movement)][:, nodes].T
+
+    def route(self, stand, runway_point, cat, movement):
+        """route(str, str, airport.WakeVortexCategory, traffic.Movement) return None | (float, int list)
+        return the shortest taxi time between the named points 'stand' and 'runway_point'
+        (from the stand for a departure, to the stand for an arrival) and the edges of
+        the path, or None if there is none"""
+        d = direction(movement)
+        table = self.edge[cat.value - 1, d, self.rank[runway_point]]
+        u = self.graph.points[stand]
+        time = float(self.time[cat.value - 1, d, self.rank[runway_point], u])
+        if math.isinf(time):
+            return None
+        path = []
+        while table[u] >= 0:
+            path.append(int(table[u]))
+            u = int((self.graph.dst if d == DEP else self.graph.src)[table[u]])
+        return time, path if d == DEP else path[::-1]
+
+
+def direction(movement):
+    """direction(traffic.Movement) return int: DEP or ARR"""
+    return ARR if movement == traffic.Movement.ARR else DEP
+
+
+def compute(apt, one_way=True):
+    """compute(airport.Airport, bool) return RouteTable
+    computes the shortest routes between every stand and every runway point of 'apt'
+    (with one Dijkstra tree per runway point, direction and wake vortex category)"""
+    print("Computing route table...")
+    graph = Graph(apt, one_way)
+    stands = [p.name for p in apt.points if p.type == airport.PointType.STAND and p.name in graph.points]
+    runway_points = [p.name for p in apt.points
+                     if p.type == airport.PointType.RUNWAY_POINT and p.name in graph.points]
+    shape = (len(airport.WakeVortexCategory), 2, len(runway_points), len(graph.xy))
+    time, edge = np.full(shape, np.inf, dtype=np.float32), np.full(shape, -1, dtype=np.int32)
+    done = {}
+    for cat in airport.WakeVortexCategory:
+        c, allowed = cat.value - 1, graph.allowed(cat)
+        # categories allowed on the same edges share the same trees
+        same = [other for (other, mask) in done.items() if (mask == allowed).all()]
+        if same:
+            time[c], edge[c] = time[same[0]], edge[same[0]]
+        else:
+            for (r, name) in enumerate(runway_points):
+                for d in (DEP, ARR):
+                    time[c, d, r], edge[c, d, r] = graph.tree(graph.points[name], cat, reverse=d == DEP)
+        done[c] = allowed
+    return RouteTable(graph, stands, runway_points, time, edge)
+
+
+def from_file(apt, apt_filename, one_way=True):
+    """from_file(airport.Airport, str, bool) return RouteTable
+    return the route table of 'apt' loaded from the airport file 'apt_filename':
+    it is read from the table file next to the airport file if it is up to date,
+    or computed and saved otherwise"""
+    extra = "{} {}".format(VERSION, SNAP)
+    suffix = SUFFIX if one_way else TWO_WAY_SUFFIX
+    columns = datacache.load(apt_filename, extra, suffix)
+    if columns is not None:
+        print("Loading route table:", apt_filename + suffix + '...')
+        return RouteTable(Graph(apt, one_way), columns['stands'].tolist(), columns['runway_points'].tolist(),
+                          columns['time'], columns['edge'])
+    table = compute(apt, one_way)
+    datacache.save(apt_filename, {'stands': np.array(table.stands, dtype=str),
+                                  'runway_points': np.array(table.runway_points, dtype=str),
+                                  'time': table.time, 'edge': table.edge}, extra, suffix)
+    return table
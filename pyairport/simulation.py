@@ -2,6 +2,13 @@
 
 This module defines the interactions with the simulation"""
 
+import collections
+import queue
+import threading
+
+import numpy as np
+
+import detection
 import traffic
 
 SHORTCUTS = """Shortcuts:
@@ -9,30 +16,219 @@ n: next time step
 b: last time step
 q: close window"""
 
+QUEUE_DEPTH = 20  # Time steps computed ahead by a Stepper
+PUT_TIMEOUT = 0.05  # Delay between two checks of the stop request of a Stepper waiting for room (seconds)
+TRAIL_LENGTH = 5  # Positions in the comet of each flight, the current one included
+
+# Immutable state of the simulation at a time step, with the following fields:
+# - t: int (time step)
+# - since: None | int (time step of the previous state of the simulation, to which
+#   'entered' and 'left' are relative)
+# - flights: Flight tuple (flights moving at 't')
+# - comets: read-only int32 array (n, length, 2) (last positions of 'flights', see Trails)
+# - conflicts: Flight frozenset (flights in conflict in [t, t + traffic.DT])
+# - entered: Flight tuple (flights moving at 't' but not at 'since')
+# - left: Flight tuple (flights moving at 'since' but not at 't')
+Snapshot = collections.namedtuple('Snapshot', 't since flights comets conflicts entered left')
+
+# Change of the list of the moving flights, with the following fields:
+# - added: Flight tuple (flights that began moving, or all the moving flights on resync)
+# - removed: Flight tuple (flights that stopped moving)
+# - resync: bool (the previous list must be dropped before applying the change)
+# The flights that are neither added nor removed keep moving.
+FlightsDelta = collections.namedtuple('FlightsDelta', 'added removed resync')
+
+
+class Trails:
+    """Ring buffer of the last positions of the moving flights, with the following attributes:
+    - length: int (number of positions kept for each flight)
+    - t: None | int (time step of the last update)
+    - rows: (Flight -> int) dict (row of each flight in 'xy')
+    - free: int list (unused rows of 'xy')
+    - xy: int32 array (capacity, length, 2) (position at time step s of the
+      flight of each row, in the column s % length)
+    Each update only looks up the positions of the time steps entering the
+    window (one batch lookup per update), and the whole window of the new
+    flights or after a time jump."""
+
+    def __init__(self, length=TRAIL_LENGTH):
+        self.length = length
+        self.t = None
+        self.rows = {}
+        self.free = []
+        self.xy = np.zeros((0, length, 2), dtype=np.int32)
+
+    def update(self, flights, t):
+        """update(Flight list, int) return int32 array (n, length, 2)
+        moves the window to time step 't' and returns the positions of
+        'flights' from time step 't - length + 1' to 't'"""
+        if self.t is None or abs(t - self.t) >= self.length:
+            # time jump: nothing can be kept
+            self.rows, self.free = {}, list(range(len(self.xy)))
+        moving = set(flights)
+        for f in [f for f in self.rows if f not in moving]:
+            self.free.append(self.rows.pop(f))
+        kept = [f for f in flights if f in self.rows]
+        new = [f for f in flights if f not in self.rows]
+        if len(new) > len(self.free):
+            capacity = max(2 * len(self.xy), len(self.xy) + len(new) - len(self.free))
+            self.free.extend(range(len(self.xy), capacity))
+            self.xy = np.concatenate((self.xy, np.zeros((capacity - len(self.xy), self.length, 2), np.int32)))
+        for f in new:
+            self.rows[f] = self.free.pop()
+        window = np.arange(t - self.length + 1, t + 1)
+        if new:
+            rows = np.array([self.rows[f] for f in new])
+            self.xy[rows[:, None], window % self.length] = traffic.track(new, window[0], window[-1])
+        if kept and t != self.t:
+            # only the time steps entering the window, at its end or its beginning
+            t1, t2 = (self.t + 1, t) if t > self.t else (window[0], self.t - self.length)
+            rows = np.array([self.rows[f] for f in kept])
+            self.xy[rows[:, None], np.arange(t1, t2 + 1) % self.length] = traffic.track(kept, t1, t2)
+        self.t = t
+        rows = np.array([self.rows[f] for f in flights], dtype=np.int64)
+        return self.xy[rows[:, None], window % self.length]
+
 
 class Simulation:
     """The simulation state, with the following attributes:
     - airport: airport.Airport (the airport)
-    - flights: traffic.Flight list (the traffic)
-    - t: int (current time step)"""
+    - all_flights: traffic.TrafficStore | traffic.LazyTraffic (the traffic)
+    - active: traffic.ActiveFlights (the flights moving at the current time step)
+    - t: int (current time step)
+    - conflicts: (Flight -> None) dict (flights in conflict in [t, t + traffic.DT])
+    - step_conflicts: (int -> (Flight, Flight) list) dict (conflicting pairs
+      of all the moving flights at each time step of the window [t, t + traffic.DT])
+    - step_sep: int (separation used to compute 'step_conflicts')
+    - timeline: None | timeline.Timeline (precomputed conflicts, used when valid)
+    - trails: Trails (last positions of the moving flights)
+    - since: None | int (time step before the last move)
+    - entered, left: Flight tuple (flights that began or stopped moving at the last move)"""
 
-    def __init__(self, apt, flights, init_time=traffic.DAY // 2):
+    def __init__(self, apt, flights, init_time=traffic.DAY // 2, conflict_timeline=None,
+                 trail_length=TRAIL_LENGTH):
         self.airport = apt
         self.all_flights = flights
+        self.timeline = conflict_timeline
         self.conflicts = {}
+        self.step_conflicts = {}
+        self.step_sep = traffic.SEP
+        self.trails = Trails(trail_length)
         self.t = init_time
-        self.current_flights = traffic.select(self.all_flights, self.t)
+        self.active = traffic.ActiveFlights(flights, self.t)
+        self.current_flights = self.active.flights()
+        self.since = None
+        self.entered, self.left = tuple(self.current_flights), ()
 
     def set_time(self, t):
         """set_time(int): set the current time to 't'"""
-        self.t = t
-        self.current_flights = traffic.select(self.all_flights, self.t)
-        conflicts = traffic.detect_in(self.current_flights, self.t, self.t + traffic.DT)
+        self.since, self.t = self.t, t
+        self.current_flights = self.active.move_to(self.t)
+        # the change of the moving flights, computed once for all the listeners
+        self.entered = tuple(self.all_flights[i] for i in self.active.entered)
+        self.left = tuple(self.all_flights[i] for i in self.active.left)
+        conflicts = self.detect_conflicts()
         #        if len(self.conflicts) < len(conflicts):
         #            self.timer.stop()
         self.conflicts = conflicts
 
+    def detect_conflicts(self):
+        """detect_conflicts() return (Flight -> None) dict
+        return the flights moving at 't' that conflicts in [t, t + traffic.DT]
+        (same result as 'traffic.detect_in'): only the time steps that are not
+        yet in the window cache are detected, the expired ones are dropped
+        (or the conflicts are simply looked up in the timeline if there is one)"""
+        t1, t2 = self.t, self.t + traffic.DT
+        if self.timeline is not None and self.timeline.is_valid():
+            return self.timeline.conflicts(t1, t2)
+        if self.step_sep != traffic.SEP:
+            self.step_conflicts, self.step_sep = {}, traffic.SEP
+        self.step_conflicts = {t: pairs for (t, pairs) in self.step_conflicts.items() if t1 <= t <= t2}
+        missing = [t for t in range(t1, t2 + 1) if t not in self.step_conflicts]
+        if missing:
+            flights = self.all_flights.between(missing[0], missing[-1])
+            for t in range(missing[0], missing[-1] + 1):
+                self.step_conflicts[t] = []
+            for (i, j, t) in zip(*detection.conflict_pairs(flights, missing[0], missing[-1])):
+                self.step_conflicts[t].append((flights[i], flights[j]))
+        conflicts = {}
+        for pairs in self.step_conflicts.values():
+            for (fi, fj) in pairs:
+                # both flights must be moving at 't'
+                if fi.start_t <= t1 and fj.start_t <= t1:
+                    conflicts[fi] = conflicts[fj] = None
+        return conflicts
+
+    def conflict_pairs(self, t):
+        """conflict_pairs(int) return (Flight, Flight) list
+        return the pairs of flights that conflict at time step 't' of the
+        window [t, t + traffic.DT] of the current time step, whichever the
+        detection used (the timeline or the window cache)"""
+        if self.timeline is not None and self.timeline.is_valid():
+            return self.timeline.pairs(t)
+        return self.step_conflicts.get(t, [])
+
     def increment_time(self, dt):
         """increment_time(int): increases the current time step by 'dt'
         (dt might be negative)"""
         self.set_time(self.t + dt)
+
+    def snapshot(self):
+        """snapshot() return Snapshot: immutable copy of the current state"""
+        comets = self.trails.update(self.current_flights, self.t)
+        comets.setflags(write=False)
+        return Snapshot(self.t, self.since, tuple(self.current_flights), comets, frozenset(self.conflicts),
+                        self.entered, self.left)
+
+
+class Stepper(threading.Thread):
+    """Thread computing ahead the next time steps of a simulation,
+    with the following attributes:
+    - simulation: Simulation (only used by this thread until it is stopped)
+    - increment: int (time steps between two snapshots)
+    - snapshots: queue.Queue (the QUEUE_DEPTH next snapshots, in time order,
+      followed by the exception that stopped the thread if some)"""
+
+    def __init__(self, simu, increment, depth=QUEUE_DEPTH):
+        super().__init__(daemon=True)
+        self.simulation = simu
+        self.increment = increment
+        self.snapshots = queue.Queue(depth)
+        self.stopping = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                self.simulation.increment_time(self.increment)
+                self.put(self.simulation.snapshot())
+        except Exception as error:
+            # the error is raised again in the thread reading the snapshots
+            self.put(error)
+
+    def put(self, item):
+        """put(Snapshot | Exception): queues 'item' as soon as there is room,
+        unless the thread is asked to stop meanwhile"""
+        while not self.stopping.is_set():
+            try:
+                self.snapshots.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def next_snapshot(self):
+        """next_snapshot() return None | Snapshot
+        return the next computed snapshot, or None if it is not ready yet
+        (the exception that stopped the thread is raised instead, if some)"""
+        try:
+            item = self.snapshots.get_nowait()
+        except queue.Empty:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self):
+        """stop(): stops the thread and waits for it, the simulation being then
+        at the time step of the last computed snapshot"""
+        self.stopping.set()
+        self.join()
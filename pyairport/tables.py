@@ -0,0 +1,14 @@
+"""Tabular output files.
+
+This module writes the rows of results (dictionaries of fields) computed
+by the command line tools (see batch, occupancy and src/sweep) as CSV files."""
+
+import csv
+
+
+def write_csv(filename, fields, rows):
+    """write_csv(str, str tuple, dict list): writes 'rows' in the CSV file 'filename'"""
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
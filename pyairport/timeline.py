@@ -0,0 +1,122 @@
+"""Precomputed conflict timeline.
+
+This module computes once all the conflicts of a whole traffic sample,
+as the time intervals during which each pair of flights conflicts,
+and saves them in a binary file next to the traffic file, so that the
+conflicts at any time step are then obtained by a simple lookup."""
+
+import numpy as np
+
+import datacache
+import detection
+import occupancy
+import traffic
+
+CHUNK = 3600 // traffic.STEP  # Time steps detected in a single batch
+SUFFIX = '.conflicts.npz'  # Suffix of the timeline file added to the traffic file name
+
+
+class Timeline:
+    """Conflicts of a traffic sample, with the following attributes:
+    - store: traffic.TrafficStore (the traffic)
+    - sep: int (minimal separation used, see traffic.SEP)
+    - rwy_sep: int (runway area width used, see traffic.RWY_SEP)
+    - first, second: int arrays (store indices of the flights of each conflict)
+    - start, end: int arrays (first and last time steps of each conflict)"""
+
+    def __init__(self, store, sep, rwy_sep, first, second, start, end):
+        self.store = store
+        self.sep = sep
+        self.rwy_sep = rwy_sep
+        self.first = first
+        self.second = second
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return "<timeline.Timeline {0} conflicts>".format(len(self.start))
+
+    def is_valid(self):
+        """is_valid() return bool
+        tells if the timeline was computed with the current separations"""
+        return self.sep == traffic.SEP and self.rwy_sep == traffic.RWY_SEP
+
+    def conflicts(self, t1, t2):
+        """conflicts(int, int) return (Flight -> None) dict
+        return the dictionary of the flights moving at time step 't1' that conflicts
+        between time steps 't1' and 't2' (same result as 'traffic.detect_in')"""
+        start_t = self.store.start_t
+        found = ((self.start <= t2) & (self.end >= t1) &
+                 (start_t[self.first] <= t1) & (start_t[self.second] <= t1))
+        indices = np.unique(np.concatenate((self.first[found], self.second[found])))
+        return {self.store[i]: None for i in indices}
+
+    def pairs(self, t):
+        """pairs(int) return (Flight, Flight) list
+        return the pairs of flights that conflict at time step 't'"""
+        found = np.flatnonzero((self.start <= t) & (self.end >= t))
+        return [(self.store[i], self.store[j])
+                for (i, j) in zip(self.first[found].tolist(), self.second[found].tolist())]
+
+
+def compute(store):
+    """compute(traffic.TrafficStore) return Timeline
+    detects all the conflicts of 'store': the separation ones one batch of CHUNK
+    time steps at a time, the runway ones as overlaps of the runway occupancy
+    intervals (see occupancy.RunwayOccupancy)"""
+    print("Computing conflict timeline...")
+    first, second, steps = [], [], []
+    if len(store):
+        t_min, t_max = int(store.start_t.min()), int(store.end_t.max())
+        for t1 in range(t_min, t_max, CHUNK):
+            t2 = min(t1 + CHUNK, t_max) - 1
+            flights = store.between(t1, t2)
+            i, j, t = detection.conflict_pairs(flights, t1, t2, runways=False)
+            indices = np.array([f.index for f in flights], dtype=np.int64)
+            i, j = indices[i], indices[j]
+            first.append(np.minimum(i, j))
+            second.append(np.maximum(i, j))
+            steps.append(t)
+        runways = list(dict.fromkeys(f.runway for f in store))
+        i, j, t = occupancy.RunwayOccupancy(store, runways).conflict_steps()
+        first.append(np.minimum(i, j))
+        second.append(np.maximum(i, j))
+        steps.append(t)
+    if first:
+        conflicts = np.unique(np.stack([np.concatenate(a) for a in (first, second, steps)], axis=1), axis=0)
+    else:
+        conflicts = np.zeros((0, 3), dtype=np.int64)
+    first, second, t = conflicts.T
+    if len(t) == 0:
+        return Timeline(store, traffic.SEP, traffic.RWY_SEP, first, second, t, t)
+    # split the time steps of each pair into intervals of consecutive time steps
+    new = np.ones(len(t), dtype=bool)
+    new[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1]) | (t[1:] != t[:-1] + 1)
+    starts = np.flatnonzero(new)
+    ends = np.append(starts[1:], len(t)) - 1
+    return Timeline(store, traffic.SEP, traffic.RWY_SEP,
+                    first[starts], second[starts], t[starts], t[ends])
+
+
+def from_files(apt_filename, traffic_filename, store):
+    """from_files(str, str, traffic.TrafficStore) return Timeline
+    return the timeline of 'store' loaded from the traffic file 'traffic_filename'
+    at the airport 'apt_filename': it is read from the timeline file next to the
+    traffic file if its hash matches, or computed and saved otherwise"""
+    key = datacache.digest([apt_filename, traffic_filename],
+                           "{} {} {}".format(traffic.STEP, traffic.SEP, traffic.RWY_SEP))
+    filename = traffic_filename + SUFFIX
+    try:
+        with np.load(filename) as data:
+            if str(data['key']) == key:
+                print("Loading conflict timeline:", filename + '...')
+                return Timeline(store, traffic.SEP, traffic.RWY_SEP,
+                                data['first'], data['second'], data['start'], data['end'])
+    except Exception:
+        # missing, outdated or unreadable (truncated, empty...) timeline file
+        pass
+    timeline = compute(store)
+    datacache.write(filename, key=key,
+                    first=timeline.first.astype(np.int32), second=timeline.second.astype(np.int32),
+                    start=timeline.start.astype(np.int32), end=timeline.end.astype(np.int32))
+    return timeline
@@ -4,8 +4,17 @@ This module allows to load a traffic file
 and to access all its flights information.
 """
 
+import collections
+import concurrent.futures
 import enum
+import itertools
+import os
+import weakref
+
+import numpy as np
+
 import airport
+import datacache
 import geometry
 
 STEP = 5  # Time step (seconds)
@@ -13,6 +22,9 @@ DAY = 24 * 3600 // STEP  # Day duration in time steps
 SEP = 70  # Minimal separation (meters)
 RWY_SEP = 90  # Runway area width
 DT = 120 // STEP  # Conflict anticipation time
+JUMP = 3600 // STEP  # Time move above which the active flights are fully recomputed
+HOUR = 3600 // STEP  # Hour duration in time steps
+SLOT_WINDOW = (-5 * 60 // STEP, 10 * 60 // STEP)  # Take-off window around the slot (time steps)
 
 
 # Movement type: departure or arrival
@@ -40,7 +52,9 @@ class Flight:
     - end_t: int (ending time step)
     - rwy_t: int (time step in runway for DEP - or out runway for ARR)
     - slot: None | int (time step of the take-of slot if some)
-    - route: airport.XY tuple (assigned route)"""
+    - route: int32 array (n, 2) (assigned route, view into the TrafficStore)
+    - store: TrafficStore (store holding the route)
+    - index: int (index of the flight in its store)"""
 
     def __init__(self, call_sign, flight_type, cat):
         self.call_sign = call_sign
@@ -54,6 +68,8 @@ class Flight:
         self.rwy_t = None
         self.slot = None
         self.route = None
+        self.store = None
+        self.index = None
         self.last_velo = geometry.Vector(geometry.Point(0,0),geometry.Point(0,0))
         self.engine = None
 
@@ -61,7 +77,8 @@ class Flight:
         return "<traffic.Flight {0}>".format(self.call_sign)
 
     def get_position(self, t):
-        return self.route[t - self.start_t]
+        x, y = self.route[t - self.start_t].tolist()
+        return geometry.Point(x, y)
 
     def distance(self, other, t):
         return self.get_position(t).distance(other.get_position(t))
@@ -79,6 +96,169 @@ class Flight:
                 other.use_runway(t) and self.in_runway(other.runway, t))
 
 
+class IntervalIndex:
+    """Index of the flights moving intervals [start_t, end_t[, with the following attributes:
+    - start_t: int array (beginning time step of each flight)
+    - end_t: int array (ending time step of each flight)
+    - by_start: int array (flight indices sorted by beginning time step)
+    - by_end: int array (flight indices sorted by ending time step)
+    - max_duration: int (longest flight duration)"""
+
+    def __init__(self, start_t, end_t):
+        self.start_t = start_t
+        self.end_t = end_t
+        self.by_start = np.argsort(start_t, kind='stable')
+        self.by_end = np.argsort(end_t, kind='stable')
+        self.starts = start_t[self.by_start]
+        self.ends = end_t[self.by_end]
+        self.max_duration = int((end_t - start_t).max()) if len(start_t) else 0
+
+    def at(self, t):
+        """at(int) return int array
+        return the sorted indices of the flights moving at time step 't'"""
+        return self.between(t, t)
+
+    def between(self, t1, t2):
+        """between(int, int) return int array
+        return the sorted indices of the flights moving at some time step of [t1, t2]
+        (only the flights started less than 'max_duration' before 't1' are tested)"""
+        lo = np.searchsorted(self.starts, t1 - self.max_duration, 'right')
+        hi = np.searchsorted(self.starts, t2, 'right')
+        candidates = self.by_start[lo:hi]
+        return np.sort(candidates[self.end_t[candidates] > t1])
+
+    def started(self, t1, t2):
+        """started(int, int) return int array
+        return the indices of the flights beginning in ]t1, t2]"""
+        lo, hi = np.searchsorted(self.starts, (t1, t2), 'right')
+        return self.by_start[lo:hi]
+
+    def ended(self, t1, t2):
+        """ended(int, int) return int array
+        return the indices of the flights ending in ]t1, t2]"""
+        lo, hi = np.searchsorted(self.ends, (t1, t2), 'right')
+        return self.by_end[lo:hi]
+
+
+class ActiveFlights:
+    """Flights of a TrafficStore (or LazyTraffic) moving at the current time step,
+    with the following attributes:
+    - store: TrafficStore (the traffic)
+    - t: int (current time step)
+    - indices: int set (indices of the flights moving at 't')
+    - entered: int list (indices of the flights that entered at the last move)
+    - left: int list (indices of the flights that left at the last move)
+    Small moves only look at the flights beginning or ending in between."""
+
+    def __init__(self, store, t):
+        self.store = store
+        self.t = t
+        self.indices = set(store.index.at(t).tolist())
+        self.entered = sorted(self.indices)
+        self.left = []
+
+    def __repr__(self):
+        return "<traffic.ActiveFlights {0} at {1}>".format(len(self.indices), hms(self.t))
+
+    def move_to(self, t):
+        """move_to(int) return Flight list
+        updates the current time step to 't' and returns the flights moving at 't'"""
+        index, t0 = self.store.index, self.t
+        if abs(t - t0) > JUMP:
+            indices = set(index.at(t).tolist())
+            self.entered = sorted(indices - self.indices)
+            self.left = sorted(self.indices - indices)
+            self.indices = indices
+        else:
+            if t >= t0:
+                entered, left = index.started(t0, t), index.ended(t0, t)
+                entered = entered[index.end_t[entered] > t]
+                left = left[index.start_t[left] <= t0]
+            else:
+                entered, left = index.ended(t, t0), index.started(t, t0)
+                entered = entered[index.start_t[entered] <= t]
+                left = left[index.end_t[left] > t0]
+            self.entered, self.left = entered.tolist(), left.tolist()
+            self.indices.difference_update(self.left)
+            self.indices.update(self.entered)
+        self.t = t
+        return self.flights()
+
+    def flights(self):
+        """flights() return Flight list
+        return the flights moving at the current time step, in the store order"""
+        return [self.store[i] for i in sorted(self.indices)]
+
+
+class TrafficStore:
+    """Columnar storage of a traffic sample, with the following attributes:
+    - flights: Flight list (the flights, whose routes are views into 'xy')
+    - xy: int32 array (n_points, 2) (all the routes, one after the other)
+    - offsets: int64 array (n_flights + 1) (index in 'xy' of the first point of each route)
+    - start_t: int64 array (n_flights) (beginning time step of each flight)
+    - end_t: int64 array (n_flights) (ending time step of each flight)
+    - index: IntervalIndex (index of the flights moving intervals)
+    The store can be used as a sequence of flights."""
+
+    def __init__(self, flights, xy, lengths):
+        self.flights = flights
+        self.xy = xy
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.start_t = np.array([f.start_t for f in flights], dtype=np.int64)
+        self.end_t = self.start_t + lengths
+        self.index = IntervalIndex(self.start_t, self.end_t)
+        for i, f in enumerate(flights):
+            f.store, f.index = self, i
+            f.route = self.xy[self.offsets[i]:self.offsets[i + 1]]
+
+    def __repr__(self):
+        return "<traffic.TrafficStore {0} flights>".format(len(self.flights))
+
+    def __len__(self):
+        return len(self.flights)
+
+    def __getitem__(self, i):
+        return self.flights[i]
+
+    def __iter__(self):
+        return iter(self.flights)
+
+    def active(self, t):
+        """active(int) return int array
+        return the sorted indices of the flights that are moving at time step 't'"""
+        return self.index.at(t)
+
+    def between(self, t1, t2):
+        """between(int, int) return Flight list
+        return the flights that are moving at some time step of [t1, t2]"""
+        return [self.flights[i] for i in self.index.between(t1, t2)]
+
+    def track(self, indices, t1, t2):
+        """track(int array, int, int) return int32 array (n, t2 - t1 + 1, 2)
+        return the positions of the flights 'indices' from time step 't1'
+        to 't2', clamped to the first and last points of their routes"""
+        steps = np.arange(t1, t2 + 1) - self.start_t[indices, None]
+        lengths = self.end_t[indices, None] - self.start_t[indices, None]
+        steps = np.clip(steps, 0, lengths - 1)
+        return self.xy[self.offsets[indices, None] + steps]
+
+    def positions(self, t):
+        """positions(int) return (int32 array (k, 2), int array (k,))
+        return the positions of all the flights moving at time step 't'
+        and their indices in the store"""
+        indices = self.active(t)
+        return self.xy[self.offsets[indices] + t - self.start_t[indices]], indices
+
+    def positions_in(self, t, k):
+        """positions_in(int, int) return (int32 array (n, k + 1, 2), int array (n,), bool array (n, k + 1))
+        return the positions from time step 't' to 't + k' of the flights moving at 't',
+        their indices in the store and whether they are still moving at each step"""
+        indices = self.active(t)
+        alive = np.arange(t, t + k + 1) < self.end_t[indices, None]
+        return self.track(indices, t, t + k), indices, alive
+
+
 # Time string conversions
 
 def hms(t):
@@ -97,40 +277,349 @@ def time_step(str_hms):
 
 # Load a traffic file
 
-def from_file(apt, filename):
-    """from_file(airport.Apt, str) return Flight list: reads a traffic file"""
+def from_file(apt, filename, workers=None):
+    """from_file(airport.Apt, str, int) return TrafficStore: reads a traffic file
+    (or its binary cache if it is up to date), with 'workers' processes if given"""
+    print("Loading traffic:", filename + '...')
+    columns = load_columns(apt, filename, workers)
+    for error in columns['errors']:
+        print(error)
+    flights = from_columns(apt, columns)
+    arrivals = stats(f for f in flights if f.type == Movement.ARR)
+    departures = stats(f for f in flights if f.type == Movement.DEP)
+    for h, (ah, dh) in enumerate(zip(arrivals, departures)):
+        print("{:02d}h00 - {:3d} arrivals, {:3d} departures".format(h, ah, dh))
+    return flights
+
+
+def load_columns(apt, filename, workers=None):
+    """load_columns(airport.Apt, str, int) return (str -> array) dict
+    reads a traffic file into columns of arrays (see parse_lines) from its binary
+    cache if it is up to date, or else parses it (with 'workers' processes if given)
+    and saves the cache"""
+    columns = datacache.load(filename, apt.digest())
+    if columns is None or not is_known(apt, columns):
+        columns = parse(apt, filename) if workers is None else parse_parallel(apt, filename, workers)
+        datacache.save(filename, columns, apt.digest())
+    return columns
+
+
+def is_known(apt, columns):
+    """is_known(airport.Apt, (str -> array) dict) return bool
+    tells if all the stands and QFUs of the flights described by 'columns'
+    belong to the airport 'apt' (a cache parsed with another airport is not)"""
+    return (all(name in apt.pt_dict for name in np.unique(columns['stand']).tolist()) and
+            all(name in apt.qfu_dict for name in np.unique(columns['qfu']).tolist()))
+
+
+def parse(apt, filename):
+    """parse(airport.Apt, str) return (str -> array) dict
+    reads a traffic file into columns of arrays (see parse_lines)"""
+    with open(filename) as file:
+        return parse_lines(apt, file)
+
+
+def parse_lines(apt, lines):
+    """parse_lines(airport.Apt, str iterable) return (str -> array) dict
+    reads traffic file lines into columns of arrays (times in seconds, -1 for no slot,
+    'line' being the rank of the line of each flight in 'lines')"""
     categories = {'L': airport.WakeVortexCategory.LIGHT,
                   'M': airport.WakeVortexCategory.MEDIUM,
                   'H': airport.WakeVortexCategory.HEAVY}
-    print("Loading traffic:", filename + '...')
-    file = open(filename)
-    flights = []
-    for line in file:
+    rows, routes, errors = [], [], []
+    for (line_number, line) in enumerate(lines):
         words = line.strip().split()
         try:
             movement_type = movement_from_string(words[0])
-            flight = Flight(words[1], movement_type, categories[words[2]])
-            flight.stand = apt.get_point(words[3])
-            flight.qfu = apt.get_qfu(words[4])
-            flight.runway = apt.get_runway(flight.qfu)
-            flight.rwy_t = int(words[6]) // STEP
-            flight.slot = None if words[7] == '_' else int(words[7]) // STEP
-            flight.route = airport.xys_to_points(words[8:])
-            flight.start_t = int(words[5]) // STEP
-            flight.end_t = flight.start_t + len(flight.route)
-            flights.append(flight)
+            call_sign, cat = words[1], categories[words[2]]
+            apt.get_point(words[3])
+            apt.get_runway(apt.get_qfu(words[4]))
+            rwy_t = int(words[6])
+            slot = -1 if words[7] == '_' else int(words[7])
+            route = airport.xys_to_array(words[8:])
+            start_t = int(words[5])
+            rows.append((0 if movement_type is None else movement_type.value, call_sign, cat.value,
+                         words[3], words[4], start_t, rwy_t, slot, line_number))
+            routes.append(route)
         except Exception as error:
-            print(type(error), error, line)
-    file.close()
-    arrivals = stats(f for f in flights if f.type == Movement.ARR)
-    departures = stats(f for f in flights if f.type == Movement.DEP)
-    for h, (ah, dh) in enumerate(zip(arrivals, departures)):
-        print("{:02d}h00 - {:3d} arrivals, {:3d} departures".format(h, ah, dh))
-    return flights
+            errors.append(' '.join(map(str, (type(error), error, line.rstrip('\r\n')))))
+
+    def column(i, dtype):
+        return np.array([row[i] for row in rows], dtype=dtype)
+
+    return {'type': column(0, np.int8), 'call_sign': column(1, str), 'cat': column(2, np.int8),
+            'stand': column(3, str), 'qfu': column(4, str), 'start_t': column(5, np.int64),
+            'rwy_t': column(6, np.int64), 'slot': column(7, np.int64), 'line': column(8, np.int64),
+            'xy': np.concatenate(routes) if routes else np.zeros((0, 2), dtype=np.int32),
+            'lengths': np.array([len(route) for route in routes], dtype=np.int64),
+            'errors': np.array(errors, dtype=str)}
+
+
+# Parallel parsing
+
+CHUNKS_PER_WORKER = 4  # Byte ranges of a traffic file parsed by each worker
+worker_airport = None  # Airport used by the parsing worker processes
+
+
+def init_worker(apt):
+    """init_worker(airport.Apt): sets the airport of a parsing worker process"""
+    global worker_airport
+    worker_airport = apt
+
+
+def parse_range(filename, start, end):
+    """parse_range(str, int, int) return ((str -> array) dict, int)
+    parses the lines of a traffic file beginning between the byte offsets
+    'start' and 'end' (see parse_lines), also returning their number"""
+    lines = []
+    with open(filename, 'rb') as file:
+        if start > 0:
+            # skip the end of the line beginning before 'start'
+            file.seek(start - 1)
+            start += len(file.readline()) - 1
+        while start < end:
+            line = file.readline()
+            if not line:
+                break
+            lines.append(line.decode().rstrip('\r\n'))
+            start += len(line)
+    return parse_lines(worker_airport, lines), len(lines)
+
+
+def parse_parallel(apt, filename, workers):
+    """parse_parallel(airport.Apt, str, int) return (str -> array) dict
+    reads a traffic file into columns of arrays like 'parse', splitting it into
+    byte ranges parsed by a pool of 'workers' processes"""
+    size = os.path.getsize(filename)
+    n = workers * CHUNKS_PER_WORKER
+    bounds = [size * k // n for k in range(n + 1)]
+    # the workers only need the points and runways to check the flights
+    names = airport.Airport(apt.name, apt.points, (), apt.runways)
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                initargs=(names,)) as executor:
+        results = list(executor.map(parse_range, itertools.repeat(filename), bounds[:-1], bounds[1:]))
+    first_lines = np.cumsum([0] + [count for (_, count) in results[:-1]])
+    for ((columns, _), first_line) in zip(results, first_lines):
+        columns['line'] += first_line
+    return {key: np.concatenate([columns[key] for (columns, _) in results])
+            for key in results[0][0]}
+
+
+def from_columns(apt, columns):
+    """from_columns(airport.Apt, (str -> array) dict) return TrafficStore
+    builds the traffic described by the columns read by 'parse'"""
+    flights = []
+    for (movement_type, call_sign, cat, stand, qfu, start_t, rwy_t, slot, length) in zip(
+            *(columns[key].tolist() for key in ('type', 'call_sign', 'cat', 'stand', 'qfu',
+                                               'start_t', 'rwy_t', 'slot', 'lengths'))):
+        flight = Flight(call_sign, Movement(movement_type) if movement_type else None,
+                        airport.WakeVortexCategory(cat))
+        flight.stand = apt.get_point(stand)
+        flight.qfu = apt.get_qfu(qfu)
+        flight.runway = apt.get_runway(flight.qfu)
+        flight.rwy_t = rwy_t // STEP
+        flight.slot = None if slot < 0 else slot // STEP
+        flight.start_t = start_t // STEP
+        flight.end_t = flight.start_t + length
+        flights.append(flight)
+    return TrafficStore(flights, columns['xy'], columns['lengths'])
+
+
+def to_lines(columns):
+    """to_lines((str -> array) dict) return str generator
+    yields the traffic file lines of the flights described by columns (see parse_lines)"""
+    ends = np.cumsum(columns['lengths']).tolist()
+    xy = columns['xy'].tolist()
+    for (movement_type, call_sign, cat, stand, qfu, start_t, rwy_t, slot, length, end) in zip(
+            *(columns[key].tolist() for key in ('type', 'call_sign', 'cat', 'stand', 'qfu',
+                                               'start_t', 'rwy_t', 'slot', 'lengths')), ends):
+        route = ' '.join('{},{}'.format(x, y) for (x, y) in xy[end - length:end])
+        yield ' '.join((Movement(movement_type).name if movement_type else '_', call_sign,
+                        airport.WakeVortexCategory(cat).name[0], stand, qfu, str(start_t), str(rwy_t), '_' if slot < 0 else str(slot), route)) + '\n'
+
+
+# Streaming a traffic file
+
+INDEX_SUFFIX = '.index.npz'  # Suffix of the side index file added to the traffic file name
+BLOCK = 10000  # Lines parsed at once while indexing a traffic file
+LAZY_HOURS = 4  # Hours of flights kept materialised by a LazyTraffic
+
+
+def time_index(apt, filename):
+    """time_index(airport.Apt, str) return (str -> array) dict
+    return the side index of the valid flights of a traffic file, sorted by beginning
+    time: byte 'offset' of their line, movement 'type', beginning time 'start_t'
+    (seconds) and route 'length'; the index is read from its cache file if it is
+    up to date, or else built one block of lines at a time and saved"""
+    index = datacache.load(filename, apt.digest(), INDEX_SUFFIX)
+    if index is not None:
+        return index
+    keys = ('type', 'start_t', 'lengths')
+    parts = {key: [] for key in ('offset',) + keys}
+    with open(filename, 'rb') as file:
+        offset = 0
+        for lines in iter(lambda: list(itertools.islice(file, BLOCK)), []):
+            sizes = np.array([len(line) for line in lines], dtype=np.int64)
+            columns = parse_lines(apt, (line.decode() for line in lines))
+            for error in columns['errors']:
+                print(error)
+            parts['offset'].append((offset + np.cumsum(sizes) - sizes)[columns['line']])
+            for key in keys:
+                parts[key].append(columns[key])
+            offset += sizes.sum()
+    index = {key: np.concatenate(part) if part else np.zeros(0, dtype=np.int64)
+             for (key, part) in parts.items()}
+    index['length'] = index.pop('lengths')
+    order = np.argsort(index['start_t'], kind='stable')
+    index = {key: column[order] for (key, column) in index.items()}
+    datacache.save(filename, index, apt.digest(), INDEX_SUFFIX)
+    return index
+
+
+def read_columns(apt, file, offsets):
+    """read_columns(airport.Apt, binary file, int array) return (str -> array) dict
+    reads into columns (see parse_lines) the flights whose lines begin at the byte 'offsets' of 'file'"""
+    lines = []
+    for offset in offsets.tolist():
+        file.seek(offset)
+        lines.append(file.readline().decode())
+    return parse_lines(apt, lines)
+
+
+def read_flights(apt, file, offsets):
+    """read_flights(airport.Apt, binary file, int array) return TrafficStore
+    reads the flights whose lines begin at the byte 'offsets' of 'file'"""
+    return from_columns(apt, read_columns(apt, file, offsets))
+
+
+def stream_columns(apt, filename, t1=0, t2=None):
+    """stream_columns(airport.Apt, str, int, int) return (str -> array) dict generator
+    yields the columns (see parse_lines) of the flights of a traffic file beginning
+    in [t1, t2[ (time steps), one hour of flights at a time in beginning time order,
+    seeking them with the side index of the file"""
+    index = time_index(apt, filename)
+    start_t = index['start_t'] // STEP
+    lo = np.searchsorted(start_t, t1)
+    hi = len(start_t) if t2 is None else np.searchsorted(start_t, t2)
+    with open(filename, 'rb') as file:
+        while lo < hi:
+            end = min(hi, np.searchsorted(start_t, (start_t[lo] // HOUR + 1) * HOUR))
+            yield read_columns(apt, file, index['offset'][lo:end])
+            lo = end
+
+
+def stream(apt, filename, t1=0, t2=None):
+    """stream(airport.Apt, str, int, int) return Flight generator
+    yields the flights of a traffic file beginning in [t1, t2[ (time steps)
+    in beginning time order, materialising only one hour of flights at a time"""
+    for columns in stream_columns(apt, filename, t1, t2):
+        yield from from_columns(apt, columns)
+
+
+class LazyTraffic:
+    """Traffic file whose flights are only materialised around the time steps
+    that are used, with the following attributes:
+    - airport: airport.Airport (the airport)
+    - filename: str (the traffic file)
+    - offsets: int array (byte offset of the line of each flight)
+    - start_t: int array (beginning time step of each flight)
+    - end_t: int array (ending time step of each flight)
+    - index: IntervalIndex (index of the flights moving intervals)
+    - chunks: (int -> (int, TrafficStore)) OrderedDict (the LAZY_HOURS last used
+      hours of materialised flights, with the index of their first flight)
+    - flights: (int -> Flight) WeakValueDictionary (the flights still used somewhere,
+      by number, reused when their hour is read again)
+    Flights are numbered in beginning time order, and each one is a single Flight
+    object as long as it is used. Like a TrafficStore, it can be used as a sequence
+    of flights."""
+
+    def __init__(self, apt, filename):
+        print("Indexing traffic:", filename + '...')
+        index = time_index(apt, filename)
+        self.airport = apt
+        self.filename = filename
+        self.offsets = index['offset']
+        self.start_t = index['start_t'] // STEP
+        self.end_t = self.start_t + index['length']
+        self.index = IntervalIndex(self.start_t, self.end_t)
+        self.chunks = collections.OrderedDict()
+        self.flights = weakref.WeakValueDictionary()
+
+    def __repr__(self):
+        return "<traffic.LazyTraffic {0} flights>".format(len(self.start_t))
+
+    def __len__(self):
+        return len(self.start_t)
+
+    def __getitem__(self, i):
+        first, chunk = self.chunk(int(self.start_t[i]) // HOUR)
+        return chunk[i - first]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def chunk(self, hour):
+        """chunk(int) return (int, TrafficStore)
+        return the flights beginning during 'hour' and the index of the first one,
+        reading them if they are not materialised yet (the flights of the hour
+        that are still used elsewhere are moved into the new store)"""
+        if hour in self.chunks:
+            self.chunks.move_to_end(hour)
+        else:
+            lo, hi = np.searchsorted(self.start_t, (hour * HOUR, (hour + 1) * HOUR))
+            with open(self.filename, 'rb') as file:
+                store = read_flights(self.airport, file, self.offsets[lo:hi])
+            flights = [self.flights.setdefault(lo + k, f) for (k, f) in enumerate(store)]
+            if any(f is not g for (f, g) in zip(flights, store)):
+                store = TrafficStore(flights, store.xy, np.diff(store.offsets))
+            self.chunks[hour] = (lo, store)
+            while len(self.chunks) > LAZY_HOURS:
+                self.chunks.popitem(last=False)
+        return self.chunks[hour]
+
+    def active(self, t):
+        """active(int) return int array
+        return the sorted indices of the flights that are moving at time step 't'"""
+        return self.index.at(t)
+
+    def between(self, t1, t2):
+        """between(int, int) return Flight list
+        return the flights that are moving at some time step of [t1, t2]"""
+        return [self[i] for i in self.index.between(t1, t2)]
 
 
 # Accessing traffic information
 
+def track(flights, t1, t2):
+    """track(Flight list, int, int) return int32 array (n, t2 - t1 + 1, 2)
+    return the positions of 'flights' from time step 't1' to 't2'
+    (see TrafficStore.track), with one batch lookup per store"""
+    xy = np.zeros((len(flights), t2 - t1 + 1, 2), dtype=np.int32)
+    by_store = {}
+    for k, f in enumerate(flights):
+        by_store.setdefault(f.store, []).append(k)
+    for store, ks in by_store.items():
+        indices = np.array([flights[k].index for k in ks], dtype=np.int64)
+        xy[ks] = store.track(indices, t1, t2)
+    return xy
+
+
+def positions(flights, t):
+    """positions(Flight list, int) return int32 array (n, 2)
+    return the positions of 'flights' at time step 't'"""
+    return track(flights, t, t)[:, 0]
+
+
+def use_runways(flights, t1, t2):
+    """use_runways(Flight list, int, int) return bool array (n, t2 - t1 + 1)
+    return whether each flight uses its runway at each time step
+    from 't1' to 't2' (see Flight.use_runway)"""
+    steps = np.arange(t1, t2 + 1)
+    rwy_t = np.array([f.rwy_t for f in flights]).reshape(-1, 1)
+    arrival = np.array([f.type == Movement.ARR for f in flights]).reshape(-1, 1)
+    return np.where(arrival, steps <= rwy_t, rwy_t <= steps)
+
+
 def stats(flights):
     flights_per_hour = [0] * 24
     for f in flights:
@@ -141,19 +630,25 @@ def stats(flights):
 def select(flights, t):
     """select(Flight list, int) return Flight list
     return the flights of 'flights' that are moving at time step 't'"""
+    if isinstance(flights, (TrafficStore, LazyTraffic)):
+        return [flights[i] for i in flights.active(t)]
     return [f for f in flights if f.start_t <= t < f.start_t + len(f.route)]
 
 
 def detect(flights, t):
     """detect(Flight list, int) return (Flight -> Flight list) dict
     return the dictionary of the flights that conflicts at time step 't'"""
-    conflicts = {}
-    for i, fi in enumerate(flights):
-        for j in range(i):
-            fj = flights[j]
-            if fi.conflicts(fj, t):
-                conflicts[fi] = conflicts[fj] = None
-    return conflicts
+    if len(flights) < 2:
+        return {}
+    xy = positions(flights, t).astype(float)
+    close = ((xy[:, None] - xy[None, :]) ** 2).sum(axis=2) < SEP ** 2
+    runways = list(dict.fromkeys(f.runway for f in flights))
+    corridors = np.array([geometry.seg_dists(xy, *r.coords) <= RWY_SEP for r in runways])
+    in_runway = corridors[[runways.index(f.runway) for f in flights]]
+    runway = use_runways(flights, t, t) & in_runway
+    conflict = close | runway | runway.T
+    np.fill_diagonal(conflict, False)
+    return {flights[i]: None for i in np.flatnonzero(conflict.any(axis=1))}
 
 
 def detect_in(flights, t1, t2):
@@ -187,7 +187,7 @@ class Ui_flightInspector(object):
         self.horizontalLayout_4.addWidget(self.lineEdit_callsign)
         self.verticalLayout_2.addWidget(self.frame_5)
         self.verticalLayout.addWidget(self.frame)
-        self.list_flights = QtWidgets.QListWidget(flightInspector)
+        self.list_flights = QtWidgets.QListView(flightInspector)
         self.list_flights.setObjectName("list_flights")
         self.verticalLayout.addWidget(self.list_flights)
 
@@ -1,3 +1,4 @@
+# -*- coding: latin-1 -*-
 '''
 Created on 30 nov. 2018
 
@@ -6,8 +7,10 @@ Created on 30 nov. 2018
 
 import geometry
 import traffic
+import elevation
 import math
 import random as rd
+import numpy as np
 
 TIRERADIUS = 0.56 #en mtre
 MAXEGTSTORQUE = 16000 #N.m
@@ -24,6 +27,7 @@ MASS_A321_DEP = 81000 #kg
 MASS_A321_ARR = 73000 #kg
 VMAX_DROIT = 10 #m/s
 VMAX_COURBE = 3 #m/s
+ALTI_FILE = "data_files/lfpg_alti.txt" # fichier d'altitude du terrain
 
 def vitesse(p1, p2):
     """Dfini la vitesse avec un pas de temps de 5s et de 2 points"""
@@ -58,6 +62,84 @@ def nextspeedegts(mass, slope, speed):
 
 def nextspeedclassic(speed):
     return min(speed+0.9, VMAX_DROIT)#choisir entre courbe et droit
+
+def nextspeeds(masses, slopes, speeds, egts, limits):
+    """version vectorise de nextspeedegts (avions egts) et de nextspeedclassic (autres avions)
+    pour des tableaux d'avions, la vitesse tant borne par les vitesses limites limits"""
+    slope_torque = - masses * 9.81 * np.sin(np.arctan(slopes/100)) * TIRERADIUS
+    stopped = speeds < 1
+    res_torque = - masses * np.where(stopped, BREAKAWAYRESISTANCE, ROLLINGRESISTANCE) * 10 * TIRERADIUS
+    with np.errstate(divide='ignore'):
+        egts_torque = np.where(stopped, MAXEGTSTORQUE, np.minimum(MAXEGTSTORQUE, EGTSPOWER/(speeds/TIRERADIUS)))
+    aero_torque = AEROCOEF * speeds**2
+    torque = egts_torque + slope_torque + res_torque + aero_torque
+    acc = np.maximum(0, torque/TIRERADIUS/masses)
+    return np.minimum(np.where(egts, speeds + TIMESTEP * acc, speeds + 0.9), limits)
+
+def integrate(masses, slopes, lengths, egts, limits=VMAX_DROIT, speeds=0, max_steps=10000):
+    """intgre en une fois les profils de vitesse de n avions le long de leurs routes de s segments
+    - masses : tableau (n,) (masse des avions en kg)
+    - slopes, lengths : tableaux (n, s) (pente en % et longueur en m de chaque segment, les routes
+      plus courtes tant compltes par des segments de longueur nulle, voir segments)
+    - egts : tableau boolen (n,) (avions quips EGTS, les autres suivent nextspeedclassic)
+    - limits : vitesse limite en m/s, par avion et par segment (n, s) ou commune
+    - speeds : vitesse initiale des avions en m/s
+    renvoie les tableaux (n, s + 1) des vitesses et des heures d'arrive (en s depuis le dpart)
+    en chaque point des routes (nan pour les points non atteints aprs max_steps pas de TIMESTEP)"""
+    lengths = np.asarray(lengths, dtype=float)
+    n, s = lengths.shape
+    masses = np.broadcast_to(np.asarray(masses, dtype=float), (n,))
+    egts = np.broadcast_to(np.asarray(egts, dtype=bool), (n,))
+    slopes = np.nan_to_num(np.broadcast_to(np.asarray(slopes, dtype=float), (n, s)))
+    limits = np.broadcast_to(np.asarray(limits, dtype=float), (n, s))
+    cumul = np.zeros((n, s + 1))
+    cumul[:, 1:] = np.cumsum(lengths, axis=1)
+    speed = np.zeros(n) + speeds
+    distance = np.zeros(n)
+    rows = np.arange(n)
+    next_point = np.ones(n, dtype=int) # indice du prochain point  atteindre
+    res_speeds = np.full((n, s + 1), np.nan)
+    res_times = np.full((n, s + 1), np.nan)
+    res_speeds[:, 0] = speed
+    res_times[:, 0] = 0
+
+    def reach(previous, time):
+        """enregistre les points atteints entre les distances previous et distance"""
+        moving = rows[next_point <= s]
+        while len(moving):
+            moving = moving[cumul[moving, next_point[moving]] <= distance[moving]]
+            k = next_point[moving]
+            step = distance[moving] - previous[moving]
+            ratio = np.divide(cumul[moving, k] - previous[moving], step, out=np.zeros(len(moving)), where=step > 0)
+            res_times[moving, k] = time + TIMESTEP * ratio
+            res_speeds[moving, k] = speed[moving]
+            next_point[moving] += 1
+            moving = moving[next_point[moving] <= s]
+
+    reach(distance.copy(), 0)
+    for i in range(max_steps):
+        moving = rows[next_point <= s]
+        if not len(moving):
+            break
+        seg = next_point[moving] - 1
+        speed[moving] = nextspeeds(masses[moving], slopes[moving, seg], speed[moving],
+                                   egts[moving], limits[moving, seg])
+        previous = distance.copy()
+        distance[moving] += speed[moving] * TIMESTEP
+        reach(previous, i * TIMESTEP)
+    return res_speeds, res_times
+
+def segments(field, routes):
+    """segments(elevation.ElevationField, liste de tableaux (m, 2)) renvoie les tableaux (n, s)
+    des pentes en % et des longueurs des segments des routes, complts par des zros
+    jusqu' la plus longue des routes (s segments)"""
+    s = max([len(route) - 1 for route in routes] + [0])
+    slopes, lengths = np.zeros((len(routes), s)), np.zeros((len(routes), s))
+    for (i, route) in enumerate(routes):
+        if len(route) > 1:
+            slopes[i, :len(route) - 1] = field.slope_along(route)
+            lengths[i, :len(route) - 1] = np.sqrt((np.diff(route, axis=0) ** 2).sum(axis=1))
+    return slopes, lengths
             
 def selection_flight(fichier,quota):
     """choisi les vols egts sur un fichier classique et ajoute le type de motorisation (EGTS ou classique)"""
@@ -81,27 +163,30 @@ def selection_flight(fichier,quota):
     file.close()
     
     
-def modele_acceleration(fichier_pente, quota):
-    """ recrer un nouveau fichier lfpg_flight.txt qui prend en compte la pente du terrain"""
-    callsign_egts = selection_flight(fichier_pente, quota)
-    with open(fichier_pente) as flight:
+def modele_acceleration(fichier, quota, field=None):
+    """ calcule le profil de vitesse des vols du fichier de trafic fichier en prenant en compte
+    la pente du terrain, une proportion quota des vols de catgorie M tant quips EGTS
+    les pentes sont calcules par le champ d'altitude field (elevation.ElevationField, charg
+    depuis ALTI_FILE par dfaut) et tous les vols sont intgrs en une fois par integrate
+    renvoie la liste des (call_sign, egts, vitesses, heures d'arrive en chaque point) des vols"""
+    if field is None:
+        field = elevation.from_file(ALTI_FILE)
+    call_signs, masses, egts, routes = [], [], [], []
+    with open(fichier) as flight:
         for line in flight:
-            words = line.strip.slipt()
-            speed = 0
+            words = line.strip().split()
             if words[0] == 'DEP':
                 mass = MASS_A320_DEP
             elif words[0] == 'ARR':
                 mass = MASS_A320_ARR
-
-            if words[1] in callsign_egts:
-                """Si le vol est EGTS, lui appliquer le modle d'acclration"""
-                for point in range(9,len(words)):
-                    slope = words[point][2] #je suppose que point chaque point c'est un tuple de la forme (x,y,pente)
-                    next_speed = nextspeedegts(mass, slope, speed)
-                    
-                    
-            else:
-                """lui appliquer le modle normal (si celui n'a pas t dj calculer dans le fichier qu'Ahmet aurait fait (?))"""
+            call_signs.append(words[1])
+            masses.append(mass)
+            egts.append(words[2] == 'M' and np.random.binomial(1, quota) == 1) # tirage comme selection_flight
+            routes.append(np.array([word.split(',')[:2] for word in words[8:]], dtype=float).reshape(-1, 2))
+    slopes, lengths = segments(field, routes)
+    speeds, times = integrate(masses, slopes, lengths, egts)
+    return [(call_sign, egts[i], speeds[i, :len(routes[i])], times[i, :len(routes[i])])
+            for (i, call_sign) in enumerate(call_signs)]
                 
                 
 """Faut-il extraire les vols EGTS et afficher seulement ces vols ou les mlanger avec les autres vols avec un fichier normal qui contient
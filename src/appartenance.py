@@ -2,20 +2,15 @@ import numpy as np
 import delaunay
 import geometry as geo
 
-DICT_TRIANGLE = delaunay.load_alti("data_files/lfpg_alti.txt")[0]
+ALTI_INDEX = delaunay.load_index("data_files/lfpg_alti.txt") # index de localisation, construit une seule fois
 
 def appartenance_triangle(point, dict_triangles):
     """ test d'appartenance du point D au triangle ABC, renvoie l'indice du triangle
-    il parcourt tous les triangles possibles et essaye s'il appartient ou pas"""
-    for (indice_triangle, triangle) in dict_triangles.items():
-        AB = geo.Vector(triangle.sommets[0],triangle.sommets[1])
-        BC = geo.Vector(triangle.sommets[1],triangle.sommets[2])
-        CA = geo.Vector(triangle.sommets[2],triangle.sommets[0])
-        AD = geo.Vector(triangle.sommets[0],point)
-        BD = geo.Vector(triangle.sommets[1],point)
-        CD = geo.Vector(triangle.sommets[2],point)
-        if AB.det_2D(AD) * AD.det_2D(CA) <= 0 and AB.det_2D(BD) * BD.det_2D(BC) <= 0 and CA.det_2D(CD) * CD.det_2D(BC) <= 0:
-            return indice_triangle
+    le triangle est trouvé par l'index ALTI_INDEX (mêmes indices que dict_triangles)
+    au lieu de parcourir tous les triangles possibles"""
+    indice_triangle = int(ALTI_INDEX.find((point.x, point.y))[0])
+    if indice_triangle >= 0:
+        return indice_triangle
     print(point)
     print("Le point n'appartient pas au plan")
 
@@ -56,44 +51,61 @@ def plan_triangle(triangle):
 
 #tri=Delaunay(Pt_2D)
 
-def add_z(coord, indice):
-    """ A partir de coordones coord et de la place du mot sur la ligne (indice),
-    add_z permet d'ajouter la coordone sur z du point sur coord """
-    coord = coord.strip().split(',')
-    point = geo.Point(int(coord[0]), int(coord[1]))
-    tri_contenant_pt = appartenance_triangle(point, DICT_TRIANGLE) #on récupère ici une liste contenant les objets point correspondant aux sommets du triangle
-    eq_param = plan_triangle(tri_contenant_pt)
-    z = -(eq_param[0]*point.x + eq_param[1]*point.y + eq_param[3]) / eq_param[2]
-    coord[indice] = coord[indice] + ',' + str(round(z,1))
+def add_z(coord, z):
+    """ A partir de coordonées coord ('x,y') et de l'altitude z du point,
+    add_z renvoie les coordonnées avec la coordonée sur z ajoutée ('x,y,z') """
+    if np.isnan(z):
+        print(coord)
+        print("Le point n'appartient pas au plan")
+        return coord
+    return coord + ',' + str(round(z, 1))
 
-def from_file(file_map): #### A renommer avec un nom plus explicite
-    """ from_file(file_map) permet d'ajouter l'altitude de chaque point de l'aroport  partir du fichier file_map (lfpg_map) et l'crit sur un nouveau fichier new_file_airport
-    ** S'il s'agit d'un point de l'aroport ('P'):
+def add_z_words(lines_words, places):
+    """ add_z_words(liste de listes de mots, liste de (ligne, indice)) ajoute l'altitude
+    aux coordonnées des mots lines_words[ligne][indice], toutes calculées en une seule
+    fois par ALTI_INDEX.z_at """
+    if not places:
+        return
+    xy = np.array([lines_words[i][j].split(',')[:2] for (i, j) in places], dtype=float)
+    for ((i, j), z) in zip(places, ALTI_INDEX.z_at(xy).tolist()):
+        lines_words[i][j] = add_z(lines_words[i][j], z)
+
+def write_words(lines_words, new_file):
+    """ écrit les lignes de mots lines_words sur le nouveau fichier new_file """
+    with open(new_file, 'x') as new: #'x' pour création et écriture du fichier
+        for words in lines_words:
+            new.write(' '.join(words) + ' \n')
+
+def from_file(file_map, new_file='/home/valentin/Documents/pyairport/DATA/lfpg_3Dmap.txt'): #### A renommer avec un nom plus explicite
+    """ from_file(file_map) permet d'ajouter l'altitude de chaque point de l'aéroport à partir du fichier file_map (lfpg_map) et l'écrit sur un nouveau fichier new_file
+    ** S'il s'agit d'un point de l'aéroport ('P'):
     ** S'il s'agit d'un taxiway ('L') :
-    ** S'il s'agit d'une piste ('R'): """
-    file = open(file_map)
-    new_file_airport = open('/home/valentin/Documents/pyairport/DATA/lfpg_3Dmap.txt', 'x') #'x' pour création et écriture du fichier  ##anciennement f
-    for line in file:
-        res = '' ## qu'est ce que c'est?
-        words = line.strip().split()
-        try:
-            if words[0] == 'P':  # Point description
-                add_z(words[3], 3)
-            elif words[0] == 'L':  # Taxiway description
-                for i in range(len(words[5:])):
-                    add_z(words[i+5], i+5)
-            elif words[0] == 'R':  # Runway description
-                l = len(words)
-                for i in range(1,3):
-                    add_z(words[l-i], l-i)
-        except Exception as error:
-            print(error, line)
-            
-        #partie criture sur new_file_airport
-        for word in words: 
-            res += (word + ' ')
-        new_file_airport.write(res + '\n')
-    new_file_airport.close()
-    file.close()
+    ** S'il s'agit d'une piste ('R'):
+    les altitudes de tous les points sont calculées en une seule fois """
+    lines_words, places = [], []
+    with open(file_map) as file:
+        for line in file:
+            words = line.strip().split()
+            if words[:1] == ['P']:  # Point description
+                places.append((len(lines_words), 3))
+            elif words[:1] == ['L']:  # Taxiway description
+                places.extend((len(lines_words), i) for i in range(5, len(words)))
+            elif words[:1] == ['R']:  # Runway description
+                places.extend((len(lines_words), i) for i in range(len(words) - 2, len(words)))
+            lines_words.append(words)
+    add_z_words(lines_words, places)
+    write_words(lines_words, new_file)
+
+def from_flights(file_flights, new_file):
+    """ from_flights(file_flights, new_file) permet d'ajouter l'altitude de chaque point des routes
+    du fichier de trafic file_flights (lfpg_flights) et l'écrit sur un nouveau fichier new_file """
+    lines_words, places = [], []
+    with open(file_flights) as file:
+        for line in file:
+            words = line.strip().split()
+            places.extend((len(lines_words), i) for i in range(8, len(words)))
+            lines_words.append(words)
+    add_z_words(lines_words, places)
+    write_words(lines_words, new_file)
 
 #from_file('/home/valentin/Documents/pyairport/DATA/lfpg_map.txt')
@@ -27,24 +27,11 @@ def sign(nb):
 
 
 def appartenance(p):
-    for k in tri.simplices:
-        AB = geo.Vector(coord[k[0]],coord[k[1]])
-        BC = geo.Vector(coord[k[1]],coord[k[2]])
-        CA = geo.Vector(coord[k[2]],coord[k[0]])
-        AD = geo.Vector(coord[k[0]],p)
-        BD = geo.Vector(coord[k[1]],p)
-        CD = geo.Vector(coord[k[2]],p)
-        if AD.det_2D(AB) == 0:
-            if sign(BD.det_2D(BC)) == sign(CD.det_2D(CA)):
-                    return(k)
-        elif BD.det_2D(BC) == 0:
-            if sign(AD.det_2D(AB)) == sign(CD.det_2D(CA)):
-                return(k)
-        elif CD.det_2D(CA) == 0:
-            if sign(BD.det_2D(BC)) == sign(AD.det_2D(AB)):
-                return (k)
-        elif sign(BD.det_2D(BC)) == sign(CD.det_2D(CA)) == sign(AD.det_2D(AB)):
-            return (k)
+    """renvoie le triangle (triplet d'indices de sommets) contenant le point p,
+    trouvé par l'index de localisation de Delaunay au lieu de parcourir tous les triangles"""
+    k = tri.find_simplex((p.x, p.y))
+    if k >= 0:
+        return(tri.simplices[k])
     return ("ce point n'appartient a aucun triangle")
 
 # print(coord[3],coord[30],coord[0])
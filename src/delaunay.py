@@ -21,22 +21,61 @@ class Triangle():
         return ab.vector_prod(ac).unit()
         
 
-def load_alti(filename):
-    """fichier d'altitude JBG, et revoie un dictionnaire d'objet Triangle avec comme clef leur indice ranges selon Delaunay"""
-    alti_points = []
-    dict_triangles = {} 
-    points = []
+class AltiIndex():
+    """Index de localisation des points dans les triangles d'altitude, avec les attributs :
+    - xy : tableau float (n, 2) (coordonnées horizontales des points d'altitude)
+    - z : tableau float (n,) (altitude des points)
+    - delaunay : scipy.spatial.Delaunay (triangulation des points, construite une seule fois)"""
+    def __init__(self, xy, z):
+        self.xy = xy
+        self.z = z
+        self.delaunay = Delaunay(xy)
+
+    def __len__(self):
+        return len(self.delaunay.simplices)
+
+    def find(self, points):
+        """find(tableau (m, 2)) renvoie le tableau des indices des triangles contenant
+        les points (même numérotation que load_alti, -1 pour un point hors du maillage)"""
+        return self.delaunay.find_simplex(np.asarray(points, dtype=float).reshape(-1, 2))
 
+    def z_at(self, points):
+        """z_at(tableau (m, 2)) renvoie le tableau des altitudes des points, interpolées
+        dans le plan de leur triangle (nan pour un point hors du maillage)"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        indices = self.find(points)
+        # coordonnées barycentriques des points dans leur triangle
+        transform = self.delaunay.transform[indices]
+        bary = np.einsum('nij,nj->ni', transform[:, :2], points - transform[:, 2])
+        weights = np.column_stack((bary, 1 - bary.sum(axis=1)))
+        z = (weights * self.z[self.delaunay.simplices[indices]]).sum(axis=1)
+        z[indices < 0] = np.nan
+        return z
+
+
+def read_alti(filename):
+    """read_alti(str) renvoie les tableaux (xy, z) des points du fichier d'altitude JBG"""
+    xy, z = [], []
     with open(filename) as file:
         for line in file:
             words = line.strip().split()
-            points.append([int(words[2]), int(words[3])])
-            alti_points.append(geo.Point(int(words[2]), int(words[3]), float(words[4])))
+            xy.append((int(words[2]), int(words[3])))
+            z.append(float(words[4]))
+    return np.array(xy, dtype=float).reshape(-1, 2), np.array(z, dtype=float)
 
-    for (i, triplet_sommets) in enumerate(Delaunay(points).simplices): # Delaunay.simplices est une liste de triplets d'indice de sommets
-        dict_triangles[i] = Triangle(alti_points[triplet_sommets[0]], alti_points[triplet_sommets[1]], alti_points[triplet_sommets[2]])
 
-    return dict_triangles, alti_points ######### enlever alti_points si inutile
+def load_index(filename):
+    """load_index(str) renvoie l'AltiIndex du fichier d'altitude JBG"""
+    return AltiIndex(*read_alti(filename))
+
 
+def load_alti(filename):
+    """fichier d'altitude JBG, et revoie un dictionnaire d'objet Triangle avec comme clef leur indice ranges selon Delaunay"""
+    xy, z = read_alti(filename)
+    alti_points = [geo.Point(int(x), int(y), h) for ((x, y), h) in zip(xy.tolist(), z.tolist())]
+    dict_triangles = {}
 
+    for (i, triplet_sommets) in enumerate(Delaunay(xy).simplices): # Delaunay.simplices est une liste de triplets d'indice de sommets
+        dict_triangles[i] = Triangle(alti_points[triplet_sommets[0]], alti_points[triplet_sommets[1]], alti_points[triplet_sommets[2]])
 
+    return dict_triangles, alti_points ######### enlever alti_points si inutile
@@ -0,0 +1,55 @@
+"""Champ d'altitude du terrain.
+
+Les coefficients du plan de chaque triangle d'altitude sont calculés une
+seule fois dans des tableaux NumPy, ce qui permet d'obtenir l'altitude et
+la pente de routes entières en une seule opération vectorisée."""
+
+import numpy as np
+
+import delaunay
+
+
+class ElevationField():
+    """Champ d'altitude, avec les attributs :
+    - index : delaunay.AltiIndex (localisation des points dans les triangles)
+    - plans : tableau float (t, 4) (coefficients a, b, c, d de l'équation
+      ax + by + cz + d = 0 du plan de chaque triangle, comme appartenance.plan_triangle)"""
+    def __init__(self, index):
+        self.index = index
+        vertices = np.column_stack((index.xy, index.z))[index.delaunay.simplices]
+        normals = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+        normals /= np.linalg.norm(normals, axis=1).reshape(-1, 1)
+        d = -(normals * vertices[:, 0]).sum(axis=1)
+        self.plans = np.column_stack((normals, d))
+
+    def __repr__(self):
+        return "<elevation.ElevationField {0} triangles>".format(len(self.plans))
+
+    def elevation(self, xy):
+        """elevation(tableau (..., 2)) renvoie le tableau (...) des altitudes des points xy
+        (nan pour un point hors du maillage)"""
+        xy = np.asarray(xy, dtype=float)
+        points = xy.reshape(-1, 2)
+        indices = self.index.find(points)
+        a, b, c, d = self.plans[indices].T
+        z = -(a * points[:, 0] + b * points[:, 1] + d) / c
+        z[indices < 0] = np.nan
+        return z.reshape(xy.shape[:-1])
+
+    def slope_along(self, route):
+        """slope_along(tableau (..., n, 2)) renvoie le tableau (..., n - 1) des pentes
+        en pourcentage entre les points successifs de la route (ou des routes)
+        (pente nulle entre deux points confondus ou hors du maillage)"""
+        route = np.asarray(route, dtype=float)
+        z = self.elevation(route)
+        dz = np.diff(z, axis=-1)
+        dist = np.sqrt((np.diff(route, axis=-2) ** 2).sum(axis=-1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = 100 * dz / dist
+        slopes[~np.isfinite(slopes)] = 0
+        return slopes
+
+
+def from_file(filename):
+    """from_file(str) renvoie l'ElevationField du fichier d'altitude JBG"""
+    return ElevationField(delaunay.load_index(filename))
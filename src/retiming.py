@@ -0,0 +1,211 @@
+"""Re-temporisation des trajectoires du trafic.
+
+Ce module applique le modèle d'accélération (EGTS ou classique, voir
+acceleration) aux routes d'un fichier de trafic : la partie roulage de
+chaque route est découpée en tronçons entre les arrêts, chaque tronçon est
+parcouru selon le profil de vitesse de l'avion (pentes données par le champ
+d'altitude) sans dépasser la vitesse d'origine sur chaque segment, puis la
+route est ré-échantillonnée au pas traffic.STEP.
+
+Les vols sont lus et traités une heure à la fois (traffic.stream_columns),
+éventuellement par un groupe de processus, pour produire un nouveau fichier
+de trafic ou une traffic.TrafficStore directement utilisable par Simulation."""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pyairport')) # On utilise les modules de pyairport
+
+import numpy as np
+
+import acceleration
+import airport
+import elevation
+import traffic
+
+PENDING_PER_WORKER = 2  # Heures de vols en attente de traitement par processus
+worker_field = None  # Champ d'altitude des processus de re-temporisation
+
+
+def draw_egts(columns, rng, quota):
+    """draw_egts((str -> array) dict, numpy.random.Generator, float) renvoie un tableau booléen
+    des vols équipés EGTS : une proportion quota des vols de catégorie M (comme selection_flight)"""
+    medium = columns['cat'] == airport.WakeVortexCategory.MEDIUM.value
+    return medium & (rng.random(len(medium)) < quota)
+
+
+def taxi_part(movement_type, route, rwy_step):
+    """taxi_part(int, tableau (n, 2), int) renvoie (début, fin) les indices de la partie roulage
+    de la route : avant la piste pour un départ, après la piste pour une arrivée"""
+    rwy_step = min(max(rwy_step, 0), len(route) - 1)
+    if movement_type == traffic.Movement.ARR.value:
+        return rwy_step, len(route)
+    return 0, rwy_step + 1
+
+
+def legs(taxi):
+    """legs(tableau (n, 2)) renvoie la liste des tronçons (points distincts, vitesses d'origine
+    sur chaque segment en m/s) de la partie roulage taxi entre ses arrêts, et la liste des
+    durées d'arrêt (en pas de temps) avant le premier tronçon et après chaque tronçon"""
+    moving = np.any(taxi[1:] != taxi[:-1], axis=1)
+    keep = np.concatenate(([True], moving))
+    points = taxi[keep]
+    # nombre de pas d'attente sur chaque point distinct
+    waits = np.diff(np.append(np.flatnonzero(keep), len(taxi))) - 1
+    speeds = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1)) / traffic.STEP
+    breaks = np.flatnonzero(waits[1:-1] > 0) + 1
+    bounds = np.concatenate(([0], breaks, [len(points) - 1]))
+    result = [(points[a:b + 1], speeds[a:b]) for (a, b) in zip(bounds[:-1], bounds[1:]) if b > a]
+    return result, [int(waits[0])] + [int(waits[b]) for b in bounds[1:] if b > 0]
+
+
+def retime_columns(field, columns, egts):
+    """retime_columns(elevation.ElevationField, (str -> array) dict, tableau booléen) renvoie
+    (str -> array) dict : les colonnes (voir traffic.parse_lines) des vols aux routes re-temporisées,
+    les avions egts suivant nextspeedegts et les autres nextspeedclassic ; un départ garde son
+    heure de départ et son heure de piste est décalée, une arrivée garde son heure de piste
+    (un vol dont le profil n'atteint pas la fin de la route est gardé tel quel)"""
+    offsets = np.concatenate(([0], np.cumsum(columns['lengths'])))
+    routes = [columns['xy'][a:b] for (a, b) in zip(offsets[:-1], offsets[1:])]
+    rwy_steps = (columns['rwy_t'] - columns['start_t']) // traffic.STEP
+    # tous les tronçons de tous les vols sont intégrés en une fois
+    flights_legs, flights_waits, parts = [], [], []
+    leg_routes, leg_limits, leg_flights = [], [], []
+    for (i, (movement_type, route, rwy_step)) in enumerate(zip(columns['type'].tolist(), routes,
+                                                               rwy_steps.tolist())):
+        start, end = taxi_part(movement_type, route, rwy_step) if len(route) else (0, 0)
+        parts.append((start, end))
+        flight_legs, waits = legs(route[start:end]) if end - start > 1 else ([], [])
+        flights_legs.append(len(leg_routes))
+        flights_waits.append(waits)
+        for (points, limits) in flight_legs:
+            leg_routes.append(points.astype(float))
+            leg_limits.append(limits)
+            leg_flights.append(i)
+    flights_legs.append(len(leg_routes))
+    leg_flights = np.array(leg_flights, dtype=np.int64)
+    masses = np.where(columns['type'] == traffic.Movement.DEP.value,
+                      acceleration.MASS_A320_DEP, acceleration.MASS_A320_ARR)[leg_flights]
+    slopes, lengths = acceleration.segments(field, leg_routes)
+    limits = np.full(lengths.shape, acceleration.VMAX_DROIT, dtype=float)
+    for (k, leg_limit) in enumerate(leg_limits):
+        limits[k, :len(leg_limit)] = leg_limit
+    # une arrivée sort de la piste à sa vitesse d'origine
+    first_legs = np.array(flights_legs[:-1], dtype=np.int64)
+    first_legs = first_legs[first_legs < np.array(flights_legs[1:])]
+    speeds = np.zeros(len(leg_routes))
+    arrivals = columns['type'][leg_flights[first_legs]] == traffic.Movement.ARR.value
+    speeds[first_legs[arrivals]] = limits[first_legs[arrivals], 0]
+    _, times = acceleration.integrate(masses, slopes, lengths, egts[leg_flights], limits, speeds)
+
+    xy, new_lengths, rwy_t = [], [], columns['rwy_t'].copy()
+    errors = list(columns['errors'])
+    for (i, route) in enumerate(routes):
+        start, end = parts[i]
+        first, last = flights_legs[i], flights_legs[i + 1]
+        if first == last or np.isnan(times[first:last]).any():
+            if first < last:
+                errors.append("{} route non parcourue par le profil de vitesse".format(columns['call_sign'][i]))
+            xy.append(route)
+            new_lengths.append(len(route))
+            continue
+        # points de passage (heure, position) de toute la partie roulage, arrêts compris
+        waits = flights_waits[i]
+        knots_t, knots_xy = [0.0], [leg_routes[first][0]]
+        t = waits[0] * traffic.STEP
+        for (k, wait) in zip(range(first, last), waits[1:]):
+            n = len(leg_routes[k])
+            knots_t.extend((t + times[k, :n]).tolist())
+            knots_xy.extend(leg_routes[k])
+            t = knots_t[-1] + wait * traffic.STEP
+        knots_t.append(t)
+        knots_xy.append(knots_xy[-1])
+        knots_xy = np.array(knots_xy)
+        samples = np.arange(int(np.ceil(t / traffic.STEP)) + 1) * traffic.STEP
+        taxi = np.column_stack((np.interp(samples, knots_t, knots_xy[:, 0]),
+                                np.interp(samples, knots_t, knots_xy[:, 1])))
+        xy.append(np.concatenate((route[:start], np.rint(taxi).astype(np.int32), route[end:])))
+        new_lengths.append(len(xy[-1]))
+        if columns['type'][i] != traffic.Movement.ARR.value:
+            rwy_t[i] = columns['start_t'][i] + (len(taxi) - 1) * traffic.STEP
+    result = dict(columns)
+    result.update({'xy': np.concatenate(xy) if xy else columns['xy'][:0],
+                   'lengths': np.array(new_lengths, dtype=np.int64), 'rwy_t': rwy_t,
+                   'errors': np.array(errors, dtype=str)})
+    return result
+
+
+def init_worker(alti_filename):
+    """init_worker(str): charge le champ d'altitude d'un processus de re-temporisation"""
+    global worker_field
+    worker_field = elevation.from_file(alti_filename)
+
+
+def retime_task(columns, egts):
+    """retime_task((str -> array) dict, tableau booléen) renvoie (str -> array) dict
+    re-temporise des vols dans un processus de re-temporisation (voir retime_columns)"""
+    return retime_columns(worker_field, columns, egts)
+
+
+def retime_stream(apt, filename, alti_filename, quota, seed=None, workers=None):
+    """retime_stream(airport.Apt, str, str, float, int, int) renvoie un générateur de (str -> array) dict
+    donne les colonnes des vols re-temporisés du fichier de trafic filename, une heure de vols
+    à la fois dans l'ordre des heures de départ, une proportion quota des vols de catégorie M
+    étant tirés EGTS avec la graine seed ; les heures sont traitées par workers processus si
+    donné (au plus PENDING_PER_WORKER heures en attente par processus)"""
+    rng = np.random.default_rng(seed)
+    hours = ((columns, draw_egts(columns, rng, quota))
+             for columns in traffic.stream_columns(apt, filename))
+    if workers is None:
+        field = elevation.from_file(alti_filename)
+        for (columns, egts) in hours:
+            yield retime_columns(field, columns, egts)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                initargs=(alti_filename,)) as executor:
+        pending = collections.deque()
+        for (columns, egts) in hours:
+            pending.append(executor.submit(retime_task, columns, egts))
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def retime_store(apt, filename, alti_filename, quota, seed=None, workers=None):
+    """retime_store(airport.Apt, str, str, float, int, int) renvoie traffic.TrafficStore
+    le trafic re-temporisé du fichier filename (voir retime_stream)"""
+    parts = list(retime_stream(apt, filename, alti_filename, quota, seed, workers))
+    if not parts:
+        return traffic.from_columns(apt, traffic.parse_lines(apt, []))
+    columns = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+    for error in columns['errors']:
+        print(error)
+    return traffic.from_columns(apt, columns)
+
+
+def retime_file(apt, filename, new_filename, alti_filename, quota, seed=None, workers=None):
+    """retime_file(airport.Apt, str, str, str, float, int, int): écrit le trafic re-temporisé
+    du fichier filename (voir retime_stream) dans le nouveau fichier de trafic new_filename"""
+    with open(new_filename, 'w') as file:
+        for columns in retime_stream(apt, filename, alti_filename, quota, seed, workers):
+            for error in columns['errors']:
+                print(error)
+            file.writelines(traffic.to_lines(columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('airport', help="fichier de l'aéroport (lfpg_map.txt)")
+    parser.add_argument('traffic', help="fichier de trafic (lfpg_flights.txt)")
+    parser.add_argument('alti', help="fichier d'altitude (lfpg_alti.txt)")
+    parser.add_argument('output', help="nouveau fichier de trafic")
+    parser.add_argument('--quota', type=float, default=0., help="proportion de vols M équipés EGTS")
+    parser.add_argument('--seed', type=int, help="graine du tirage des vols EGTS")
+    parser.add_argument('--workers', type=int, metavar='N', help="nombre de processus")
+    args = parser.parse_args()
+    retime_file(airport.from_file(args.airport), args.traffic, args.output, args.alti,
+                args.quota, args.seed, args.workers)
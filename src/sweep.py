@@ -0,0 +1,122 @@
+"""Balayage Monte-Carlo des quotas d'équipement EGTS.
+
+Pour chaque quota d'une grille et chaque graine, les vols EGTS sont tirés
+au hasard, le trafic est re-temporisé (voir retiming) et les résultats
+(conflits, temps de roulage, respect des créneaux de piste) sont calculés.
+Les tirages (quota, graine) sont indépendants et répartis sur un groupe de
+processus : chaque processus charge une seule fois l'aéroport, le trafic et
+le champ d'altitude, partagés en lecture seule par tous ses tirages.
+Les résultats sont agrégés par quota dans un tableau CSV."""
+
+import argparse
+import concurrent.futures
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pyairport')) # On utilise les modules de pyairport
+
+import numpy as np
+
+import airport
+import elevation
+import retiming
+import tables
+import timeline
+import traffic
+
+METRICS = ('egts', 'conflicts', 'conflict_flights', 'taxi_dep', 'taxi_arr', 'slot_compliance')
+FIELDS = ('quota', 'draws') + tuple(metric + stat for metric in METRICS for stat in ('_mean', '_std'))  # Colonnes du tableau agrégé
+worker_data = None  # (aéroport, colonnes du trafic, champ d'altitude) d'un processus du balayage
+
+
+def load_data(apt_filename, traffic_filename, alti_filename):
+    """load_data(str, str, str) renvoie (airport.Airport, (str -> array) dict, elevation.ElevationField)
+    charge l'aéroport, les colonnes du trafic (voir traffic.load_columns) et le champ d'altitude"""
+    apt = airport.from_file(apt_filename)
+    return apt, traffic.load_columns(apt, traffic_filename), elevation.from_file(alti_filename)
+
+
+def init_worker(apt_filename, traffic_filename, alti_filename):
+    """init_worker(str, str, str): charge les données d'un processus du balayage"""
+    global worker_data
+    worker_data = load_data(apt_filename, traffic_filename, alti_filename)
+
+
+def outcomes(store, egts):
+    """outcomes(traffic.TrafficStore, tableau booléen) renvoie (str -> float) dict
+    les résultats du trafic store : nombre de vols egts, de conflits et de vols en conflit,
+    temps de roulage moyens (s) des départs et des arrivées, et proportion des départs
+    avec créneau décollant dans traffic.SLOT_WINDOW autour de leur créneau"""
+    conflicts = timeline.compute(store)
+    departure = np.array([f.type == traffic.Movement.DEP for f in store], dtype=bool)
+    rwy_t = np.array([f.rwy_t for f in store], dtype=np.int64)
+    taxi = np.where(departure, rwy_t - store.start_t, store.end_t - rwy_t) * traffic.STEP
+    slot = np.array([-1 if f.slot is None else f.slot for f in store], dtype=np.int64)
+    slotted = departure & (slot >= 0)
+    delay = rwy_t[slotted] - slot[slotted]
+    return {'egts': int(egts.sum()), 'conflicts': len(conflicts.start),
+            'conflict_flights': len(np.unique(np.concatenate((conflicts.first, conflicts.second)))),
+            'taxi_dep': taxi[departure].mean() if departure.any() else np.nan,
+            'taxi_arr': taxi[~departure].mean() if (~departure).any() else np.nan,
+            'slot_compliance': (((traffic.SLOT_WINDOW[0] <= delay) & (delay <= traffic.SLOT_WINDOW[1])).mean()
+                                if len(delay) else np.nan)}
+
+
+def run_draw(quota, seed, data=None):
+    """run_draw(float, int, tuple) renvoie (str -> float) dict
+    tire les vols EGTS avec le quota et la graine seed (une même graine donne des tirages
+    emboîtés d'un quota à l'autre), re-temporise le trafic et renvoie ses résultats
+    (voir outcomes), avec les données data ou celles du processus"""
+    apt, columns, field = worker_data if data is None else data
+    egts = retiming.draw_egts(columns, np.random.default_rng(seed), quota)
+    store = traffic.from_columns(apt, retiming.retime_columns(field, columns, egts))
+    result = {'quota': quota, 'seed': seed}
+    result.update(outcomes(store, egts))
+    return result
+
+
+def sweep(apt_filename, traffic_filename, alti_filename, quotas, seeds, workers=None):
+    """sweep(str, str, str, float list, int, int) renvoie (str -> float) dict list
+    renvoie les résultats des tirages de chaque quota de quotas avec les graines 0 à seeds - 1,
+    répartis sur workers processus si donné"""
+    draws = list(itertools.product(quotas, range(seeds)))
+    if workers is None:
+        data = load_data(apt_filename, traffic_filename, alti_filename)
+        return [run_draw(quota, seed, data) for (quota, seed) in draws]
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                initargs=(apt_filename, traffic_filename,
+                                                          alti_filename)) as executor:
+        return list(executor.map(run_draw, *zip(*draws)))
+
+
+def aggregate(results):
+    """aggregate((str -> float) dict list) renvoie (str -> float) dict list
+    renvoie une ligne par quota (colonnes FIELDS) avec le nombre de tirages et la moyenne
+    et l'écart type de chaque résultat de METRICS, arrondis à 4 décimales"""
+    rows = []
+    for (quota, draws) in itertools.groupby(sorted(results, key=lambda r: r['quota']),
+                                            key=lambda r: r['quota']):
+        draws = list(draws)
+        row = {'quota': quota, 'draws': len(draws)}
+        for metric in METRICS:
+            values = np.array([draw[metric] for draw in draws], dtype=float)
+            row[metric + '_mean'] = round(float(values.mean()), 4)
+            row[metric + '_std'] = round(float(values.std()), 4)
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('airport', help="fichier de l'aéroport (lfpg_map.txt)")
+    parser.add_argument('traffic', help="fichier de trafic (lfpg_flights.txt)")
+    parser.add_argument('alti', help="fichier d'altitude (lfpg_alti.txt)")
+    parser.add_argument('output', help="fichier CSV des résultats agrégés par quota")
+    parser.add_argument('--quotas', type=float, nargs='+', default=[0., 0.25, 0.5, 0.75, 1.],
+                        help="quotas de vols M équipés EGTS")
+    parser.add_argument('--seeds', type=int, default=10, help="nombre de tirages par quota")
+    parser.add_argument('--workers', type=int, metavar='N', help="nombre de processus")
+    args = parser.parse_args()
+    tables.write_csv(args.output, FIELDS,
+                     aggregate(sweep(args.airport, args.traffic, args.alti, args.quotas, args.seeds, args.workers)))